@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import cache
+import util
+
+
+CUBE_VERSION = 1
+FILE_NAME = 'cached_counts.npz'
+SOURCE_COLUMNS = ['date', 'sender', 'is_media']  # Message columns the cube is built from
+OTHER_SENDERS = 'Other senders'
+# Date buckets from finest to coarsest: pandas period frequency and plotly bar period
+DATE_BUCKETS = {
+    'day': ('D', util.DAY_NS // 10**6),
+    'week': ('W', 7 * util.DAY_NS // 10**6),
+    'month': ('M', 'M1'),
+    'year': ('Y', 'M12'),
+}
+
+
+def count_cube(df):
+    # Message and media counts per (day, hour, sender), one row per non-empty cell
+    ns = df['date'].values.astype('datetime64[ns]').view(np.int64)
+    senders = pd.Categorical(df['sender'])
+    sender_count = max(len(senders.categories), 1)
+    days = ns // util.DAY_NS
+    first_day = days.min() if len(days) else 0
+    keys = ((days - first_day) * 24 + ns // util.HOUR_NS % 24) * sender_count + senders.codes
+    cells, inverse = np.unique(keys, return_inverse=True)
+    media = np.bincount(inverse, weights=df['is_media'].values, minlength=len(cells))
+    return pd.DataFrame({
+        'day': ((cells // sender_count // 24 + first_day) * util.DAY_NS).view('datetime64[ns]'),
+        'hour': (cells // sender_count % 24).astype(np.int8),
+        'sender': pd.Categorical.from_codes(cells % sender_count, categories=senders.categories),
+        'messages': np.bincount(inverse, minlength=len(cells)),
+        'media': media.astype(np.int64),
+    })
+
+
+def date_bucket(first_day, last_day, max_bars):
+    # Finest date bucket that keeps the number of bars within max_bars
+    for bucket, (freq, _) in DATE_BUCKETS.items():
+        if len(pd.period_range(first_day, last_day, freq=freq)) <= max_bars:
+            break
+    return bucket
+
+
+def bucket_dates(days, bucket):
+    # Start date of the bucket of each day
+    freq, _ = DATE_BUCKETS[bucket]
+    return pd.Series(days).dt.to_period(freq).dt.start_time.values
+
+
+def top_senders(cube, max_senders):
+    # Sender of each cube row, with all but the most active senders merged into one
+    totals = cube.groupby('sender', observed=True)['messages'].sum()
+    if len(totals.index) <= max_senders:
+        return cube['sender']
+    top = sorted(totals.nlargest(max_senders).index)
+    return cube['sender'].cat.set_categories(top + [OTHER_SENDERS]).fillna(OTHER_SENDERS)
+
+
+def weekdays(cube):
+    return util.WEEKDAY_NAMES[(cube['day'].values.view(np.int64) // util.DAY_NS + 3) % 7]
+
+
+def save_cube(folder, cube):
+    arrays = {
+        'version': np.array(CUBE_VERSION),
+        'day': cube['day'].values,
+        'hour': cube['hour'].values,
+        'sender.codes': cube['sender'].cat.codes.values,
+        'messages': cube['messages'].values,
+        'media': cube['media'].values,
+    }
+    arrays |= cache.encode_strings('sender.categories', cube['sender'].cat.categories)
+    with open(folder / FILE_NAME, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def load_cube(folder):
+    file = folder / FILE_NAME
+    if not file.is_file():
+        return None
+    with np.load(file) as npz:
+        if int(npz['version']) != CUBE_VERSION:
+            print(f'Ignoring cached counts with an unsupported version: {file}')
+            return None
+        categories = cache.decode_strings(npz, 'sender.categories')
+        return pd.DataFrame({
+            'day': npz['day'],
+            'hour': npz['hour'],
+            'sender': pd.Categorical.from_codes(npz['sender.codes'], categories=categories),
+            'messages': npz['messages'],
+            'media': npz['media'],
+        })
@@ -0,0 +1,171 @@
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import pandas as pd
+from pandas.api.types import union_categoricals
+import aggregate
+import profiling
+import query
+import util
+from main import Analyzer, CACHE_FILES, Importer
+
+
+COMBINED_FOLDER = 'combined'
+EXPORT_STEM = '_chat'  # Name of whatsapp exports on iOS, the folder names the chat
+
+
+def find_chats(pattern, exclude=None):
+    # Chat files in a folder (including subfolders) or matching a glob, sorted.
+    # Files in the exclude folder (e.g. outputs of earlier runs) are left out.
+    path = Path(pattern)
+    if path.is_dir():
+        files = path.rglob('*.txt')
+    else:
+        files = (Path(_) for _ in glob.glob(str(pattern), recursive=True))
+    files = [_ for _ in files if _.is_file()]
+    if exclude is not None:
+        exclude = Path(exclude).resolve()
+        files = [_ for _ in files if exclude not in _.resolve().parents]
+    return sorted(files)
+
+
+def chat_names(files):
+    # Output folder name of each chat, from its path relative to the other chats.
+    # Paths that give the same name (e.g. a.txt and a/_chat.txt) get a numbered suffix.
+    if not files:
+        return []
+    root = Path(os.path.commonpath([_.parent for _ in files]))
+    names = []
+    for file in files:
+        parts = file.relative_to(root).with_suffix('').parts
+        if parts[-1] == EXPORT_STEM and len(parts) > 1:
+            parts = parts[:-1]
+        name = '_'.join(parts)
+        name = f'{name}_chat' if name == COMBINED_FOLDER else name
+        unique_name, i = name, 1
+        while unique_name in names:
+            i += 1
+            unique_name = f'{name}_{i}'
+        names.append(unique_name)
+    return names
+
+
+def analyze_chat(file, output_folder, arg_space, custom_word_filter):
+    # Imports and analyzes one chat in a worker process. Returns its message counts,
+    # or the error, and its profiled stages. Language models and libraries stay
+    # loaded for the next chats.
+    start_time = time.perf_counter()
+    if arg_space.profile:
+        profiling.enable(trace_memory=arg_space.trace_memory)
+    try:
+        importer = Importer(
+            import_file=file, output_folder=output_folder,
+            mode='whatsapp', line_limit=arg_space.line_limit,
+            anonymize_senders=arg_space.anonymize, cache_data=arg_space.cache_data,
+            batch_size=arg_space.batch_size,
+            anonymize_key=arg_space.anonymize_key,
+            since=query.parse_since(arg_space.since), until=query.parse_until(arg_space.until),
+            senders=arg_space.senders,
+            )
+        if importer.counts.empty:
+            print(f'No messages selected in {file}, skipping the analyses.')
+            return importer.counts, None, time.perf_counter() - start_time, profiling.take_stages()
+        # Chats are analyzed in parallel, so each is analyzed in a single process by default
+        a = Analyzer(importer.df, counts=importer.counts,
+            output_folder=output_folder, font_path=arg_space.font_path,
+            lang_code=arg_space.lang_code, strong_pos_filter=arg_space.strong_filter,
+            custom_word_filter=custom_word_filter,
+            nlp_batch_size=arg_space.nlp_batch_size, nlp_processes=arg_space.nlp_processes,
+            max_senders=arg_space.max_senders,
+            render_workers=arg_space.render_workers or 1,
+            analysis_workers=arg_space.analysis_workers or 1,
+            top_messages=arg_space.top_messages, memo_size=arg_space.memo_size,
+            days=importer.days,
+        )
+        a.analyze(analyses=arg_space.analyses)
+        a.export_figures()
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}', time.perf_counter() - start_time, profiling.take_stages()
+    return a.counts, None, time.perf_counter() - start_time, profiling.take_stages()
+
+
+def combine_counts(chat_counts):
+    # Message counts of all chats, with each chat in place of the sender
+    cubes = []
+    for name, counts in chat_counts.items():
+        cube = counts.drop(columns='sender')
+        cube = cube.groupby(['day', 'hour'], as_index=False, sort=False)[['messages', 'media']].sum()
+        cube['sender'] = pd.Categorical([name] * len(cube.index), categories=[name])
+        cubes.append(cube)
+    combined = pd.concat(cubes, ignore_index=True)
+    combined['sender'] = union_categoricals([_['sender'] for _ in cubes])
+    return combined[['day', 'hour', 'sender', 'messages', 'media']]
+
+
+def write_combined(output_folder, chat_counts, arg_space):
+    # Analyses that only need message counts, over all chats
+    columns_map = Analyzer._get_columns_map()
+    analyses = [_ for _ in Analyzer._resolve_analyses(arg_space.analyses) if not columns_map[_]]
+    if not analyses:
+        print('No selected analysis can be combined, skipping the combined report.')
+        return
+    with profiling.stage('batch.combined') as record:
+        output_folder.mkdir(exist_ok=True)
+        counts = combine_counts(chat_counts)
+        aggregate.save_cube(output_folder, counts)
+        a = Analyzer(None, output_folder, counts=counts,
+            render_workers=arg_space.render_workers, analysis_workers=arg_space.analysis_workers)
+        a.analyze(analyses=analyses)
+        a.export_figures()
+        record['rows'] = len(counts.index)
+    print(f'Combined report of {len(chat_counts)} chats at: {output_folder}')
+
+
+def run(arg_space, output_folder, custom_word_filter=None):
+    # Analyzes each chat into its own folder, returns the number of failed chats
+    if arg_space.file is None:
+        raise ValueError('Batch mode requires a folder or glob of chats (-f)')
+    files = find_chats(arg_space.file, exclude=output_folder)
+    if not files:
+        raise FileNotFoundError(f'No chats found: {arg_space.file}')
+    names = chat_names(files)
+    workers = arg_space.batch_workers or os.cpu_count()
+    workers = min(workers, len(files))
+    print(f'Analyzing {len(files)} chats with {workers} workers...')
+    for name in names:
+        util.resolve_output(output_folder / name,
+            clear=arg_space.clear, force_clear=arg_space.force_clear, ignore=CACHE_FILES)
+    chat_counts = {}
+    errors = {}
+    with profiling.stage('batch.analyze') as record:
+        # Workers are reused for many chats, each loads libraries and models once
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(analyze_chat, file, output_folder / name, arg_space, custom_word_filter): name
+                for file, name in zip(files, names)
+            }
+            for i, future in enumerate(as_completed(futures)):
+                name = futures[future]
+                counts, error, elapsed, stages = future.result()
+                # Stage starts are relative to the start of the chat
+                profiling.add_stages(stages, chat=name)
+                if error is None:
+                    chat_counts[name] = counts
+                    print(f'[{i+1}/{len(files)}] Analyzed {name} in {elapsed:.2f}s')
+                else:
+                    errors[name] = error
+                    print(f'[{i+1}/{len(files)}] Failed to analyze {name}: {error}')
+        record['messages'] = sum(int(_['messages'].sum()) for _ in chat_counts.values())
+    chat_counts = {name: chat_counts[name] for name in names if name in chat_counts}
+    # Chats without selected messages are left out of the combined report
+    combined_counts = {name: counts for name, counts in chat_counts.items() if not counts.empty}
+    if arg_space.combined and combined_counts:
+        write_combined(output_folder / COMBINED_FOLDER, combined_counts, arg_space)
+    print(f'Analyzed {len(chat_counts)} of {len(files)} chats, output at: {output_folder}')
+    if errors:
+        print(f'Failed chats:')
+        for name, error in errors.items():
+            print(f'    {name}: {error}')
+    return len(errors)
@@ -0,0 +1,176 @@
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+import aggregate
+import cache
+import plotly_html
+import synthetic
+import tokens
+from main import Analyzer, Importer
+
+
+RESULTS_VERSION = 1
+DEFAULT_SIZES = ['10k', '100k', '1m']
+SIZE_SUFFIXES = {'k': 10**3, 'm': 10**6}
+NLP_ANALYSES = ['full_wordcloud', 'per_sender_wordclouds']
+# Timings shorter than this are too noisy to flag as regressions
+MIN_SECONDS = 0.05
+
+
+def parse_size(size):
+    size = size.lower()
+    if size[-1] in SIZE_SUFFIXES:
+        return int(float(size[:-1]) * SIZE_SUFFIXES[size[-1]])
+    return int(size)
+
+
+def get_chat(work_dir, message_count, seed):
+    # Seeded chats are written once and reused by later runs in the same folder
+    file = work_dir / f'chat-{message_count}-{seed}.txt'
+    if not file.is_file():
+        chat_df = synthetic.generate_chat(message_count, seed=seed,
+            days=365, end_date='2022-01-01')
+        synthetic.write_whatsapp(file, chat_df)
+    return file
+
+
+def timed(results, size, name, function, **info):
+    start_time = time.perf_counter()
+    value = function()
+    elapsed = time.perf_counter() - start_time
+    results.append({'size': size, 'name': name, 'seconds': round(elapsed, 6)} | info)
+    print(f'{size:>10,} {name:<40}{elapsed:>10.3f}s', file=sys.__stdout__)
+    return value
+
+
+def run_size(work_dir, message_count, seed, nlp, batch_size):
+    results = []
+    chat_file = get_chat(work_dir, message_count, seed)
+    output = work_dir / f'output-{message_count}'
+    output.mkdir(exist_ok=True)
+    for file in output.iterdir():
+        file.unlink()  # Start without a token cache
+    df = timed(results, message_count, 'import_chat_whatsapp',
+        lambda: Importer.import_chat_whatsapp(chat_file, batch_size=batch_size),
+        bytes=chat_file.stat().st_size)
+    counts = timed(results, message_count, 'count_cube', lambda: aggregate.count_cube(df))
+    cache_file = output / Importer.CACHED_DF_NAME
+    timed(results, message_count, 'cache_write', lambda: cache.save_frame(cache_file, df))
+    results[-1]['bytes'] = cache_file.stat().st_size
+    timed(results, message_count, 'cache_read', lambda: cache.load_frame(cache_file))
+    analyzer = Analyzer(df, output, counts=counts, render_workers=1, analysis_workers=1)
+    for analysis in Analyzer._resolve_analyses(['all']):
+        if analysis in NLP_ANALYSES and not nlp:
+            continue
+        # Shared intermediates are timed with the first analysis that needs them
+        timed(results, message_count, f'analysis.{analysis}', lambda: analyzer.analyze([analysis]))
+    for category, figs in analyzer.figures.items():
+        file = output / f'{category}.html'
+        timed(results, message_count, f'write_html.{category}',
+            lambda: plotly_html.write_html(figs, file, title=category), figures=len(figs))
+    return results
+
+
+def run(sizes, seed, nlp, work_dir, batch_size, repeat, verbose):
+    # Keeps the fastest of the repeated runs of each benchmark
+    from plotly import express  # Not to be timed with the first analysis
+    best = {}
+    for size in sizes:
+        for _ in range(repeat):
+            with contextlib.ExitStack() as stack:
+                if not verbose:
+                    stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+                results = run_size(work_dir, size, seed, nlp, batch_size)
+            for result in results:
+                key = (result['size'], result['name'])
+                if key not in best or result['seconds'] < best[key]['seconds']:
+                    best[key] = result
+    return list(best.values())
+
+
+def compare(results, baseline, threshold):
+    # Benchmarks slower than the baseline by more than the threshold ratio
+    baseline = {(_['size'], _['name']): _['seconds'] for _ in baseline['results']}
+    regressions = []
+    print(f'{"Size":>10} {"Benchmark":<40}{"Baseline":>10}{"Current":>10}{"Ratio":>8}')
+    for result in results['results']:
+        key = (result['size'], result['name'])
+        if key not in baseline:
+            continue
+        base, current = baseline[key], result['seconds']
+        ratio = current / max(base, 1e-9)
+        regressed = ratio > 1 + threshold and current - base > MIN_SECONDS
+        flag = '  REGRESSION' if regressed else ''
+        print(f'{key[0]:>10,} {key[1]:<40}{base:>10.3f}{current:>10.3f}{ratio:>8.2f}{flag}')
+        if regressed:
+            regressions.append(result | {'baseline': base, 'ratio': round(ratio, 3)})
+    print(f'{len(regressions)} regressions (threshold: {threshold:.0%})')
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark import, analysis and export on seeded synthetic chats.')
+    parser.add_argument('--sizes', dest='sizes', type=str, nargs='*', default=DEFAULT_SIZES,
+        help=f'Number of messages of each chat, e.g. 10k 1m 10m (default: {" ".join(DEFAULT_SIZES)})')
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+        help='Random seed for generating the chats')
+    parser.add_argument('-o', dest='output', type=Path, default=None,
+        help='File to write the results to (json)')
+    parser.add_argument('--baseline', dest='baseline', type=Path, default=None,
+        help='Results file to compare against, exits with an error on regressions')
+    parser.add_argument('--results', dest='results', type=Path, default=None,
+        help='Compare an existing results file instead of running the benchmarks')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.25,
+        help='Slowdown ratio over the baseline that is flagged as a regression')
+    parser.add_argument('--no-nlp', dest='nlp', action='store_false',
+        help='Skip the analyses that require a language model')
+    parser.add_argument('--work-dir', dest='work_dir', type=Path, default=None,
+        help='Folder for the generated chats and outputs, reused between runs (default: temporary)')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=100_000,
+        help='Import batch size')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=1,
+        help='Number of runs of each size, the fastest is kept')
+    parser.add_argument('-v', dest='verbose', action='store_true',
+        help='Show the output of the benchmarked code')
+    args = parser.parse_args()
+    if args.results is not None:
+        results = json.loads(args.results.read_text())
+    else:
+        nlp = args.nlp and tokens.model_id(Analyzer(None, None).model_name) is not None
+        if args.nlp and not nlp:
+            print('No language model installed, skipping the analyses that require it.')
+        with contextlib.ExitStack() as stack:
+            work_dir = args.work_dir
+            if work_dir is None:
+                work_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+            work_dir.mkdir(parents=True, exist_ok=True)
+            sizes = [parse_size(_) for _ in args.sizes]
+            results = {
+                'version': RESULTS_VERSION,
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'seed': args.seed,
+                'nlp': nlp,
+                'results': run(sizes, args.seed, nlp, work_dir,
+                    args.batch_size, args.repeat, args.verbose),
+            }
+        if args.output is not None:
+            args.output.write_text(json.dumps(results, indent=4))
+            print(f'Wrote results to: {args.output}')
+    if args.baseline is not None:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
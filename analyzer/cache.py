@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import query
+
+
+CACHE_VERSION = 1
+COLUMNS = ['date', 'sender', 'message', 'weekday', 'hour', 'is_media']
+
+
+def save_frame(file, df, anonymized=False, anonymize_key_id=None):
+    # Typed columns in an uncompressed npz, each column is stored separately
+    # so that it can be loaded on its own. Whether the senders are aliases, and
+    # the id of their key, are loaded into the attrs of the frame.
+    date = pd.to_datetime(df['date'])
+    sender = df['sender'].astype('category')
+    arrays = {
+        'version': np.array(CACHE_VERSION),
+        'date': date.values,
+        'weekday': date.dt.weekday.values.astype(np.int8),
+        'hour': date.dt.hour.values.astype(np.int8),
+        'sender.codes': sender.cat.codes.values,
+        'is_media': df['is_media'].values.astype(bool),
+        'anonymized': np.array(anonymized),
+        'anonymize_key_id': np.array(anonymize_key_id or ''),
+    }
+    arrays |= encode_strings('sender.categories', sender.cat.categories)
+    arrays |= encode_strings('message', df['message'])
+    with open(file, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def load_frame(file, columns=None, since=None, until=None):
+    # Messages are cached sorted by date, so only the rows from since to until
+    # are found with a binary search and decoded
+    columns = COLUMNS if columns is None else [_ for _ in COLUMNS if _ in columns]
+    with np.load(file) as npz:
+        version = int(npz['version'])
+        if version != CACHE_VERSION:
+            raise ValueError(f'Unsupported cache version {version} in {file}')
+        rows = slice(None)
+        date_span = None
+        if since is not None or until is not None:
+            dates = npz['date']
+            if len(dates):
+                date_span = (dates.min(), dates.max())
+            if query.is_sorted(dates):
+                rows = query.date_rows(dates, since, until)
+            else:  # Cached before messages were sorted
+                mask = np.ones(len(dates), dtype=bool)
+                if since is not None:
+                    mask &= dates >= np.datetime64(since, 'ns')
+                if until is not None:
+                    mask &= dates < np.datetime64(until, 'ns')
+                rows = np.flatnonzero(mask)
+        data = {column: _COLUMN_LOADERS[column](npz, rows) for column in columns}
+        df = pd.DataFrame(data)
+        if date_span is not None:  # Of all messages, for the days of the period
+            df.attrs['date_span'] = date_span
+        if 'anonymized' in npz.files:  # Unknown for chats cached before it was stored
+            df.attrs['anonymized'] = bool(npz['anonymized'])
+            df.attrs['anonymize_key_id'] = str(npz['anonymize_key_id']) or None
+    return df
+
+
+def encode_strings(name, strings):
+    # Concatenated utf-8 text with the byte offset of each string
+    encoded = [_.encode('utf-8') for _ in strings]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    return {
+        f'{name}.text': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        f'{name}.byte_offsets': np.concatenate([[0], np.cumsum(lengths)]),
+    }
+
+
+def decode_strings(npz, name, rows=slice(None)):
+    # Only the text of the rows is decoded
+    if f'{name}.byte_offsets' not in npz.files:
+        return _decode_legacy_strings(npz, name, rows)
+    offsets = npz[f'{name}.byte_offsets']
+    starts, ends = offsets[:-1][rows], offsets[1:][rows]
+    if not len(starts):
+        return []
+    first = int(starts.min())
+    data = npz[f'{name}.text'][first:int(ends.max())]
+    text = data.tobytes().decode('utf-8')
+    starts, ends = starts - first, ends - first
+    if len(text) != len(data):
+        # Character offsets, without the continuation bytes of multi-byte characters
+        continuation = np.concatenate([[0], np.cumsum((data & 0xC0) == 0x80)])
+        starts, ends = starts - continuation[starts], ends - continuation[ends]
+    return [text[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+
+
+def _decode_legacy_strings(npz, name, rows):
+    # Character offsets of older caches, the whole text is decoded
+    offsets = npz[f'{name}.offsets']
+    text = npz[f'{name}.text'].tobytes().decode('utf-8')
+    starts, ends = offsets[:-1][rows].tolist(), offsets[1:][rows].tolist()
+    return [text[start:end] for start, end in zip(starts, ends)]
+
+
+def _load_sender(npz, rows):
+    categories = decode_strings(npz, 'sender.categories')
+    return pd.Categorical.from_codes(npz['sender.codes'][rows], categories=categories)
+
+
+_COLUMN_LOADERS = {
+    'date': lambda npz, rows: npz['date'][rows],
+    'sender': _load_sender,
+    'message': lambda npz, rows: decode_strings(npz, 'message', rows),
+    'weekday': lambda npz, rows: npz['weekday'][rows],
+    'hour': lambda npz, rows: npz['hour'][rows],
+    'is_media': lambda npz, rows: npz['is_media'][rows],
+}
@@ -0,0 +1,41 @@
+import json
+import socket
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+
+DEFAULT_PORT = 8765
+HOST = '127.0.0.1'  # Local requests only
+
+
+def send_request(request, port=DEFAULT_PORT, socket_path=None):
+    # Sends a request to a running server (see server.py), returns its response
+    if socket_path is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(str(socket_path))
+    else:
+        connection = socket.create_connection((HOST, port))
+    with connection, connection.makefile('rwb') as f:
+        f.write(json.dumps(request).encode() + b'\n')
+        f.flush()
+        return json.loads(f.readline())
+
+
+def main():
+    parser = ArgumentParser(description='Send a request to a running analysis server and print the response.')
+    parser.add_argument('request', type=str,
+        help='Json request, e.g. \'{"analyses": ["time"], "since": "2022-01-01", "senders": ["Alice"]}\' '
+            'or \'{"command": "status"}\' (commands: analyze, status, reload, shutdown)')
+    parser.add_argument('--port', dest='port', type=int, default=DEFAULT_PORT,
+        help=f'Port of the server on {HOST} (default: {DEFAULT_PORT})')
+    parser.add_argument('--socket', dest='socket', type=Path, default=None,
+        help='Unix socket of the server, instead of a port')
+    args = parser.parse_args()
+    response = send_request(json.loads(args.request), port=args.port, socket_path=args.socket)
+    print(json.dumps(response, indent=4))
+    sys.exit(0 if response['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
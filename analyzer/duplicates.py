@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+
+
+# Variation selectors and skin tone modifiers, emojis are the same without them
+EMOJI_VARIANTS = dict.fromkeys([0xfe0e, 0xfe0f, *range(0x1f3fb, 0x1f400)])
+TRAILING_PUNCTUATION = ' .,!?;:…'
+SHINGLE_SIZE = 3
+MINHASH_SIZE = 32
+LSH_BANDS = 8  # Pairs of 0.8 similarity share a band 98% of the time
+SIMILARITY_THRESHOLD = 0.8
+MAX_CANDIDATES = 20_000  # Most common messages that are clustered
+
+
+def normalize(messages):
+    # Case, whitespace, trailing punctuation and emoji variants do not make messages different
+    normalized = []
+    for message in messages:
+        if not message.isascii():
+            message = message.translate(EMOJI_VARIANTS)
+        collapsed = ' '.join(message.casefold().split())
+        # Messages of only punctuation are kept as they are
+        normalized.append(collapsed.rstrip(TRAILING_PUNCTUATION) or collapsed)
+    return np.array(normalized, dtype=object)
+
+
+def common_messages(messages, top=1000, max_candidates=MAX_CANDIDATES, seed=0):
+    # The top most common messages that occur more than once, near-duplicates are
+    # counted together. Returns a frame of count, variants and a representative message.
+    raw_codes, raw = pd.factorize(np.asarray(messages, dtype=object))
+    if len(raw) == 0:
+        return pd.DataFrame({'count': [], 'variants': [], 'message': []})
+    raw_counts = np.bincount(raw_codes, minlength=len(raw))
+    # Normalize each unique message once
+    norm_codes, _ = pd.factorize(normalize(raw))
+    norm_counts = np.bincount(norm_codes, weights=raw_counts).astype(np.int64)
+    # Only the most common messages are candidates, most common first
+    candidates = _top_indices(norm_counts, max(max_candidates, top))
+    candidate_index = np.full(len(norm_counts), -1)
+    candidate_index[candidates] = np.arange(len(candidates))
+    # The most common original form represents each normalized message
+    order = np.lexsort((-raw_counts, norm_codes))
+    first = np.r_[True, norm_codes[order][1:] != norm_codes[order][:-1]]
+    representative = np.empty(len(norm_counts), dtype=np.int64)
+    representative[norm_codes[order][first]] = order[first]
+    texts = raw[representative[candidates]]
+    labels = cluster(texts, seed=seed)
+    # Count clusters, each is labeled by its most common message
+    counts = np.bincount(labels, weights=norm_counts[candidates], minlength=len(candidates)).astype(np.int64)
+    raw_candidates = candidate_index[norm_codes]
+    variants = np.bincount(labels[raw_candidates[raw_candidates >= 0]], minlength=len(candidates))
+    clusters = np.flatnonzero((counts > 1) & (labels == np.arange(len(labels))))
+    clusters = clusters[_top_indices(counts[clusters], top)]
+    return pd.DataFrame({
+        'count': counts[clusters],
+        'variants': variants[clusters],
+        'message': texts[clusters],
+    })
+
+
+def cluster(texts, seed=0):
+    # Groups near-duplicate texts with MinHash signatures and LSH bands, texts are
+    # expected most common first. Returns the index of the first text in the group of each text.
+    if len(texts) == 0:
+        return np.empty(0, dtype=np.int64)
+    signatures = minhash(texts, seed=seed)
+    rows = MINHASH_SIZE // LSH_BANDS
+    u, v = [], []
+    for band in range(LSH_BANDS):
+        keys = np.ascontiguousarray(signatures[:, band*rows:(band+1)*rows])
+        _, groups = np.unique(keys.view(f'V{keys.itemsize * rows}').ravel(), return_inverse=True)
+        first = np.full(groups.max() + 1, len(texts))
+        np.minimum.at(first, groups, np.arange(len(texts)))
+        u.append(np.arange(len(texts)))
+        v.append(first[groups])
+    u, v = np.concatenate(u), np.concatenate(v)
+    # Candidate pairs with a more common text, whose estimated similarity is high enough
+    pairs = v < u
+    u, v = u[pairs], v[pairs]
+    similar = (signatures[u] == signatures[v]).mean(axis=1) >= SIMILARITY_THRESHOLD
+    u, v = u[similar], v[similar]
+    order = np.lexsort((v, u))
+    u, v = u[order].tolist(), v[order].tolist()
+    # Most common first, each text joins the first similar text that leads a group.
+    # Groups do not chain, every text in a group is similar to its first text.
+    labels = np.arange(len(texts))
+    for text, other in zip(u, v):
+        if labels[text] == text and labels[other] == other:
+            labels[text] = other
+    return labels
+
+
+def minhash(texts, seed=0):
+    # MinHash signatures of character shingles, one row per text
+    shingles, lengths = [], []
+    for text in texts:
+        padded = f' {text} '
+        count = max(len(padded) - SHINGLE_SIZE + 1, 1)
+        shingles.extend(padded[i:i+SHINGLE_SIZE] for i in range(count))
+        lengths.append(count)
+    hashes = pd.util.hash_array(np.array(shingles, dtype=object))
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    # Multiply-shift hash functions, the products wrap around on purpose
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, 2**63, size=MINHASH_SIZE, dtype=np.uint64) | np.uint64(1)
+    offsets = rng.integers(0, 2**63, size=MINHASH_SIZE, dtype=np.uint64)
+    signatures = np.empty((len(texts), MINHASH_SIZE), dtype=np.uint32)
+    with np.errstate(over='ignore'):
+        for i in range(MINHASH_SIZE):
+            permuted = (hashes * multipliers[i] + offsets[i]) >> np.uint64(32)
+            signatures[:, i] = np.minimum.reduceat(permuted, starts)
+    return signatures
+
+
+def _top_indices(values, top):
+    # Indices of the top largest values, largest first, ties by index
+    if len(values) > top:
+        threshold = -np.partition(-values, top - 1)[top - 1]
+        above = np.flatnonzero(values > threshold)
+        tied = np.flatnonzero(values == threshold)[:top - len(above)]
+        indices = np.concatenate([above, tied])
+    else:
+        indices = np.arange(len(values))
+    return indices[np.lexsort((indices, -values[indices]))]
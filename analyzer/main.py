@@ -1,228 +1,705 @@
+import time
+STARTUP_TIME = time.perf_counter()
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import copy
+import importlib.metadata
+import itertools
+import json
+import os
 import random
-import arrow
-from collections import Counter, defaultdict
+import threading
+from collections import defaultdict
+import numpy as np
 import pandas as pd
-from plotly import express as px
-from wordcloud import WordCloud
-import spacy
+from pandas.api.types import union_categoricals
 import util
+import aggregate
+import cache
+import duplicates
+import memo
 import plotly_html
+import profiling
+import query
+import render
+import scheduler
+import synthetic
+import tokens
+import whatsapp
 
 
-DATE_FORMAT = 'YYYY-MM-DD HH:mm:ss'
-WHATSPP_MEDIA_MESSAGE = '<Media omitted>'
+WHATSPP_MEDIA_MESSAGE = whatsapp.MEDIA_MESSAGE
 
 
 class Importer:
-    CACHED_DF_NAME = 'cached_df.json'
+    CACHED_DF_NAME = 'cached_df.npz'
+    LEGACY_CACHED_DF_NAME = 'cached_df.json'
+    CHECKPOINT_NAME = 'cached_checkpoint.json'
 
     def __init__(self,
             import_file=None, output_folder=None,
             mode='randomgen', line_limit=None, anonymize_senders=True,
-            cache_data=False,
+            cache_data=False, batch_size=100_000, columns=None, seed=None,
+            anonymize_key=None, since=None, until=None, senders=None,
         ):
         self.output_folder = output_folder
+        self.__anonymize_key = anonymize_key
         self.__salt = str(random.random())[-4:]
         self.__crypto_names = copy.copy(util.CRYPTO_NAMES)
         random.shuffle(self.__crypto_names)
         self.__sender_map = {}
+        self.__aliases = set()
+        self.__known_senders = {}
+        self.__resumed_aliases = set()  # Senders of the cached rows of a resumed import
+        self.checkpoint = None
+        self.anonymized = False  # Whether the senders are aliases, and the id of their key
+        self.anonymize_key_id = None
+        self.counts = None  # Message counts per (day, hour, sender), see aggregate.count_cube
+        self.days = None  # First and last day of the selected period, see query.period_days
+        date_span = None  # First and last date of the chat
+        new_rows = 0  # Index of the first row that was not imported from the cache
+        filtered = since is not None or until is not None or bool(senders)
         # Get data
         import_methods = {'whatsapp': self.import_chat_whatsapp}
-        if mode == 'randomgen':
+        resumed_rows = None
+        if mode == 'whatsapp' and cache_data and not line_limit:
+            with profiling.stage('import.resume') as record:
+                resumed_rows = self._resume_whatsapp(Path(import_file), anonymize_senders, batch_size)
+                if resumed_rows is not None:
+                    record['rows'] = len(self.df.index) - resumed_rows
+        if resumed_rows is not None:
+            new_rows = resumed_rows
+        elif mode == 'randomgen':
             print(f'Generating random data...')
-            self.df = self.import_chat_random(line_limit=line_limit)
+            with profiling.stage('import.generate') as record:
+                self.df = self.import_chat_random(line_limit=line_limit, seed=seed)
+                record['rows'] = len(self.df.index)
         elif mode == 'cached':
             print(f'Using cached data...')
-            self.df = self.import_cached_dataframe(self.output_folder)
+            with profiling.stage('import.cached') as record:
+                if not cache_data and not filtered:
+                    self.counts = aggregate.load_cube(self.output_folder)
+                if self.counts is None and columns is not None:
+                    columns = set(columns) | set(aggregate.SOURCE_COLUMNS)
+                # Re-caching requires all columns and messages
+                if cache_data:
+                    self.df = self.import_cached_dataframe(self.output_folder)
+                else:
+                    self.df = self.import_cached_dataframe(self.output_folder,
+                        columns=columns, since=since, until=until)
+                    date_span = self.df.attrs.get('date_span')
+                record['rows'] = len(self.df.index)
+            # Aliases of a cached chat are kept, anonymizing them again would change them
+            self.anonymized = self.df.attrs.get('anonymized', False)
+            self.anonymize_key_id = self.df.attrs.get('anonymize_key_id')
+            if anonymize_senders and self.anonymized and self.anonymize_key_id != self._anonymize_key_id():
+                print(f'Cached chat was anonymized with another key, keeping its aliases.')
         elif mode in import_methods:
             print(f'Importing data from file...')
-            self.df = import_methods[mode](Path(import_file), line_limit=line_limit)
+            self.df = import_methods[mode](Path(import_file),
+                line_limit=line_limit, batch_size=batch_size)
+            self.checkpoint = self.df.attrs.get('checkpoint')
         else:
             raise ValueError(f'No such mode: {mode}')
         # Process data
-        if anonymize_senders:
-            self.df['sender'] = [self._anonymize_sender(_) for _ in self.df['sender']]
+        anonymize = anonymize_senders and not self.anonymized
+        if anonymize and senders and self.__anonymize_key is None and not new_rows:
+            # New random aliases, a sender could not have been named by them
+            raise ValueError('Senders are selected by their aliases, which are new in this import: '
+                'cache the anonymized chat first (--cache), or use --anon-key or --no-anon')
+        if anonymize and 'sender' in self.df:
+            with profiling.stage('import.anonymize') as record:
+                names = pd.Categorical(self.df['sender'].iloc[new_rows:]).remove_unused_categories()
+                anonymized = self._anonymize_senders(names)
+                aliases = set(self.__sender_map.values())
+                if new_rows:
+                    # The resumed rows share the categories of the new names, which are dropped
+                    resumed = pd.Categorical(self.df['sender'].iloc[:new_rows]).remove_unused_categories()
+                    anonymized = union_categoricals([resumed, anonymized])
+                    aliases |= self.__resumed_aliases
+                # No name that is not also an alias may be left in the categories
+                if set(names.categories).intersection(anonymized.categories).difference(aliases):
+                    raise RuntimeError('Sender names were left after anonymization')
+                self.df['sender'] = anonymized
+                record['rows'] = len(self.df.index) - new_rows
+        if 'sender' in self.df:
+            self.df['sender'] = self.df['sender'].astype('category')
+        if 'date' in self.df and not self.df['date'].is_monotonic_increasing:
+            # Kept sorted so that periods are found with a binary search (see query.date_rows)
+            with profiling.stage('import.sort') as record:
+                self.df = self.df.sort_values('date', kind='stable', ignore_index=True)
+                record['rows'] = len(self.df.index)
+        if self.counts is None and (cache_data or not filtered):
+            with profiling.stage('import.counts') as record:
+                self.counts = aggregate.count_cube(self.df)
+                record['rows'] = len(self.df.index)
+        elif self.counts is not None and anonymize:
+            self.counts['sender'] = self._anonymize_senders(self.counts['sender'])
+        if anonymize:
+            self.anonymized, self.anonymize_key_id = True, self._anonymize_key_id()
         # Post-import
         print(f'Import completed.')
         with pd.option_context('display.min_rows', 30):
-            print(self.df)
+            print(self.df if len(self.df.columns) else self.counts)
+        util.print_memory_usage(self.df)
         if cache_data:
-            self.cache_dataframe(self.df)
+            with profiling.stage('import.cache') as record:
+                self.cache_dataframe(self.df)
+                self.cache_counts(self.counts)
+                self.cache_checkpoint(import_file)
+                record['rows'] = len(self.df.index)
+        if filtered:
+            with profiling.stage('import.filter') as record:
+                if date_span is None and len(self.df.index):
+                    date_span = (self.df['date'].iloc[0], self.df['date'].iloc[-1])
+                if date_span is not None and (since is not None or until is not None):
+                    self.days = query.period_days(*date_span, since=since, until=until)
+                self.df = query.filter_frame(self.df, since=since, until=until, senders=senders)
+                self.counts = aggregate.count_cube(self.df)
+                record['rows'] = len(self.df.index)
+            print(f'Selected {len(self.df.index):,} messages.')
+
+    def _anonymize_key_id(self):
+        # Identifies the key in the cache without storing it, and changes with
+        # the format of keyed aliases so that older aliases are not mixed in
+        if self.__anonymize_key is None:
+            return None
+        return util.h256(f'anonymize key {util.KEYED_ALIAS_VERSION} {self.__anonymize_key}')[:16]
+
+    def _anonymize_senders(self, senders):
+        # Each unique sender is anonymized once, in order of first appearance,
+        # then the categorical codes are remapped to the aliases
+        senders = pd.Categorical(senders)
+        aliases = np.empty(len(senders.categories), dtype=object)
+        for code in pd.unique(senders.codes):
+            aliases[code] = self._anonymize_sender(senders.categories[code])
+        alias_codes, alias_names = pd.factorize(aliases)  # Unused categories have no alias
+        return pd.Categorical.from_codes(alias_codes[senders.codes], categories=alias_names)
 
     def _anonymize_sender(self, name):
         if name in self.__sender_map:
             return self.__sender_map[name]
-        if self.__crypto_names:
-            self.__sender_map[name] = self.__crypto_names.pop(0)
+        known_key = util.h256(f'{name}{self.__salt}')
+        if self.__anonymize_key is not None:
+            alias = util.keyed_alias(name, self.__anonymize_key)
+        elif known_key in self.__known_senders:
+            alias = self.__known_senders[known_key]
+        elif self.__crypto_names:
+            alias = self.__crypto_names.pop(0)
         else:
-            self.__sender_map[name] = util.h256(f'{name}{self.__salt}')[:6]
-        return self.__sender_map[name]
+            alias = known_key[:12]
+        # Senders with the same alias would be counted as one
+        if alias in self.__aliases:
+            raise ValueError(f'Two senders have the same alias: {alias}')
+        self.__aliases.add(alias)
+        self.__sender_map[name] = alias
+        return alias
+
+    def _resume_whatsapp(self, import_file, anonymize_senders, batch_size):
+        checkpoint = self.import_checkpoint(self.output_folder)
+        if checkpoint is None:
+            return None
+        key_id = self._anonymize_key_id() if anonymize_senders else None
+        if checkpoint['anonymized'] != anonymize_senders or checkpoint.get('anonymize_key_id') != key_id:
+            print(f'Cached chat anonymization does not match, re-importing...')
+            return None
+        prefix_hash = util.file_hash(import_file, size=checkpoint['file_offset'])
+        if prefix_hash != checkpoint['prefix_sha256']:
+            print(f'Chat file has changed since it was cached, re-importing...')
+            return None
+        cached_df = self.import_cached_dataframe(self.output_folder)
+        # The last message of the file is the last one of its date, messages are sorted by date
+        last_date = np.datetime64(pd.Timestamp(checkpoint['last_date']), 'ns')
+        last_row = query.date_rows(cached_df['date'].values, until=last_date + 1).stop - 1
+        if (len(cached_df.index) != checkpoint['message_count'] or last_row < 0
+                or cached_df['date'].values[last_row] != last_date):
+            print(f'Cached chat does not match its checkpoint, re-importing...')
+            return None
+        print(f'Importing new messages from file...')
+        # Re-import from the last cached message, it may have new continuation lines
+        new_df = self.import_chat_whatsapp(import_file,
+            batch_size=batch_size, offset=checkpoint['file_offset'])
+        new_df = new_df.astype(cached_df.dtypes.drop('sender').to_dict())
+        cached_df = cached_df.drop(index=last_row)
+        self.__resumed_aliases = set(cached_df['sender'].cat.categories)
+        sender = union_categoricals([cached_df['sender'].values, new_df['sender'].values])
+        self.df = pd.concat([cached_df, new_df], ignore_index=True)
+        self.df['sender'] = sender
+        self.checkpoint = new_df.attrs['checkpoint'] | {
+            'salt': checkpoint['salt'],
+            'known_senders': checkpoint['known_senders'],
+        }
+        self.__salt = checkpoint['salt']
+        self.__known_senders = checkpoint['known_senders']
+        known_aliases = set(self.__known_senders.values())
+        self.__crypto_names = [_ for _ in self.__crypto_names if _ not in known_aliases]
+        print(f'Resumed cached chat with {len(new_df.index) - 1} new messages.')
+        return len(cached_df.index)
+
+    @classmethod
+    def import_cached_dataframe(cls, cache_dir, columns=None, since=None, until=None):
+        cache_dir = Path(cache_dir)
+        cached_df_file = cache_dir / cls.CACHED_DF_NAME
+        if cached_df_file.is_file():
+            return cache.load_frame(cached_df_file, columns=columns, since=since, until=until)
+        cached_df_json = cache_dir / cls.LEGACY_CACHED_DF_NAME
+        if cached_df_json.is_file():
+            print(f'Using legacy cached chat file: {cached_df_json}')
+            df = pd.read_json(cached_df_json).drop(columns=['day'], errors='ignore')
+            df['sender'] = df['sender'].astype('category')
+            util.add_time_columns(df)
+            return df if columns is None else df[[_ for _ in df.columns if _ in columns]]
+        raise FileNotFoundError(f'Missing cached chat file from {cached_df_file}')
 
     @classmethod
-    def import_cached_dataframe(cls, cache_dir):
+    def import_checkpoint(cls, cache_dir):
         cache_dir = Path(cache_dir)
-        cached_df_json = cache_dir / cls.CACHED_DF_NAME
-        if not cached_df_json.is_file():
-            raise FileNotFoundError(f'Missing cached chat file from {cached_df_json}')
-        return pd.read_json(cached_df_json)
+        checkpoint_file = cache_dir / cls.CHECKPOINT_NAME
+        cache_files = [cache_dir / cls.CACHED_DF_NAME, cache_dir / cls.LEGACY_CACHED_DF_NAME]
+        if not checkpoint_file.is_file() or not any(_.is_file() for _ in cache_files):
+            return None
+        return json.loads(util.file_load(checkpoint_file))
 
     def cache_dataframe(self, df):
         output = self.output_folder / self.CACHED_DF_NAME
-        df.to_json(output)
+        cache.save_frame(output, df,
+            anonymized=self.anonymized, anonymize_key_id=self.anonymize_key_id)
         print(f'Cached chat at: {output}')
 
-    @staticmethod
-    def import_chat_whatsapp(target_file, line_limit=0):
-        line_limit = 10**9 if line_limit == 0 else line_limit
-        print(f'Processing whatsapp chat: {target_file} (max: {line_limit} lines)')
-        chat_content = util.file_load(target_file)
-        chat_lines = chat_content.split('\n')
-        chat_df = pd.DataFrame(columns=['date', 'sender', 'message'])
-        print(f'Number of lines in chat: {len(chat_lines)}')
-        # Process messages
-        for i, line in enumerate(chat_lines[:line_limit]):
-            if i % 1000 == 0:
-                print(f'Processing line #{i}')
-            try:
-                date, line = line.split(' - ', 1)
-                sender, message = line.split(': ', 1)
-                date = arrow.get(date, 'M/D/YY, HH:mm').format(DATE_FORMAT)
-                chat_df.loc[len(chat_df.index)] = [date, sender, message]
-            except Exception:
-                if len(chat_df['date']) > 0:
-                    chat_df.loc[len(chat_df.index)-1, 'message'] += f'\n{line}'
-                else:
-                    print(f'Failed to process line: {line}')
+    def cache_counts(self, counts):
+        aggregate.save_cube(self.output_folder, counts)
+        print(f'Cached message counts at: {self.output_folder / aggregate.FILE_NAME}')
 
-        print(f'Post processing days...')
-        chat_df['day'] = chat_df['date'].apply(lambda x: arrow.get(x).format('YYYY-MM-DD'))
-        chat_df['weekday'] = chat_df['date'].apply(lambda x: arrow.get(x).format('dddd'))
-        print(f'Post processing hours...')
-        chat_df['hour'] = chat_df['date'].apply(lambda x: arrow.get(x).format('HH'))
-        chat_df['is_media'] = chat_df['message'] == WHATSPP_MEDIA_MESSAGE
+    def cache_checkpoint(self, import_file):
+        output = self.output_folder / self.CHECKPOINT_NAME
+        if self.checkpoint is None or self.checkpoint['last_date'] is None:
+            # The cached chat was not imported from a file, nothing to resume
+            output.unlink(missing_ok=True)
+            return
+        # Aliases of senders are kept for resumed imports. The salt is stored with them,
+        # so anyone with the checkpoint can find the alias of a guessed name: the
+        # checkpoint de-anonymizes senders and must not be shared. Keyed aliases are
+        # derived from the key instead and are not stored.
+        known_senders = dict(self.checkpoint.get('known_senders', {}))
+        salt = self.checkpoint.get('salt', self.__salt)
+        if self.__anonymize_key is None:
+            for name, alias in self.__sender_map.items():
+                known_senders[util.h256(f'{name}{salt}')] = alias
+        checkpoint = self.checkpoint | {
+            'prefix_sha256': util.file_hash(import_file, size=self.checkpoint['file_offset']),
+            'message_count': len(self.df.index),
+            'anonymized': self.anonymized,
+            'anonymize_key_id': self.anonymize_key_id,
+            'salt': salt,
+            'known_senders': known_senders,
+        }
+        util.file_dump(output, json.dumps(checkpoint, indent=4))
+        print(f'Cached checkpoint at: {output}')
 
-        print(f'Imported whatsapp chat.')
+    @staticmethod
+    def import_chat_whatsapp(target_file, line_limit=0, batch_size=100_000, offset=0):
+        line_limit = None if line_limit == 0 else line_limit
+        print(f'Processing whatsapp chat: {target_file} (max: {line_limit or "all"} lines)')
+        start_time = time.perf_counter()
+        reader = whatsapp.ChatReader(target_file, line_limit=line_limit, offset=offset)
+        records = reader.records()
+        columns = ['date', 'sender', 'message']
+        batches = []
+        with profiling.stage('import.read') as record:
+            for batch in whatsapp.iter_batches(records, batch_size):
+                batches.append(pd.DataFrame(batch, columns=columns))
+                print(f'Processed {reader.line_count:,} lines...')
+            chat_df = pd.concat(batches, ignore_index=True) if batches else pd.DataFrame(columns=columns)
+            record['lines'] = reader.line_count
+            record['rows'] = len(chat_df.index)
+        line_count = reader.line_count
+        print(f'Number of lines in chat: {line_count}')
+
+        print(f'Post processing dates...')
+        with profiling.stage('import.post_process') as record:
+            chat_df['sender'] = chat_df['sender'].astype('category')
+            util.add_time_columns(chat_df)
+            chat_df['is_media'] = chat_df['message'] == WHATSPP_MEDIA_MESSAGE
+            record['rows'] = len(chat_df.index)
+
+        chat_df.attrs['checkpoint'] = {
+            'file_offset': reader.last_offset,
+            'last_date': None if reader.last_date is None else str(reader.last_date),
+        }
+        elapsed = time.perf_counter() - start_time
+        print(f'Imported whatsapp chat: {line_count:,} lines in {elapsed:.2f}s ({line_count / max(elapsed, 1e-9):,.0f} lines/sec)')
         return chat_df
 
     @staticmethod
-    def import_chat_random(line_limit=0, senders=None):
+    def import_chat_random(line_limit=0, senders=None, seed=None):
         line_limit = 2_000 if line_limit == 0 else line_limit
         print(f'Creating random chat history with {line_limit} messages')
-        chat_df = pd.DataFrame(columns=['date', 'sender', 'message', 'day', 'weekday', 'hour'])
         if senders is None:
             senders = ['Alice', 'Bob', 'Charlie', 'Dave', 'Eve']
-        # Generate messages
-        for i in range(line_limit):
-            message = util.generate_random_line()
-            sender = random.choice(senders)
-            msg_date = util.generate_random_date()
-            date = msg_date.format(DATE_FORMAT)
-            day = msg_date.format('YYYY-MM-DD')
-            weekday = msg_date.format('dddd')
-            hour = msg_date.format('HH')
-            if i % 1000 == 0:
-                print(f'Generating message #{i}: ({sender} @ {date}) {message}')
-            chat_df.loc[len(chat_df.index)] = [date, sender, message, day, weekday, hour]
-        chat_df['is_media'] = False
+        chat_df = synthetic.generate_chat(line_limit, seed=seed, senders=senders)
+        util.add_time_columns(chat_df)
+        chat_df['is_media'] = chat_df['message'] == WHATSPP_MEDIA_MESSAGE
 
         print(f'Generated random chat.')
         return chat_df
 
 
 class Analyzer:
+    # Pipeline components the wordcloud filters never use (see interesting_pos)
+    NLP_DISABLED_PIPES = ['parser', 'ner', 'lemmatizer', 'senter']
+    # Bounds on the data points of each figure, regardless of the chat length
+    MAX_BARS = 200
+    MAX_PLOT_SENDERS = 10
+    # Loaded language models by name, shared by the analyzers of a process (e.g. in batch mode)
+    _nlp_models = {}
+    plotly_lock = threading.Lock()  # Figures are not built thread safely, analyses may run concurrently
+    # Part of every memoized output key, outputs of earlier versions are not reused
+    OUTPUT_VERSION = 1
+
     def __init__(self, df, output_folder, font_path=None,
             lang_code='en', strong_pos_filter=True, custom_word_filter=None,
+            nlp_batch_size=1000, nlp_processes=1, max_senders=5, render_workers=None,
+            counts=None, analysis_workers=None, top_messages=1000, memo_size=0,
+            cache_folder=None, days=None,
         ):
-        self.figures = defaultdict(list)
+        self.task_figures = defaultdict(list)  # (category, figure) pairs added by each analysis
+        self.task_divs = defaultdict(list)  # (category, div) pairs of the figures of each analysis
+        self.task_files = defaultdict(list)  # Names of the files written by each analysis
+        self.task_keys = {}  # Fingerprint of the inputs of each analysis
+        self._input_keys = {}  # Fingerprints of inputs shared by analyses
+        self.memo = None if not memo_size else memo.Memo(output_folder, max_mb=memo_size)
+        self.analyzed = []
+        self._task = threading.local()
         self.df = df
-        self.df_nomedia = self.df[~self.df.is_media]
+        self._text_mask = None
+        self._counts = counts
+        self._all_days_range = None
+        self.days = days  # First and last day of the analyzed period, by default of the messages
+        self._plot_senders = None
         self.output_folder = output_folder
+        self.cache_folder = output_folder if cache_folder is None else cache_folder  # For the token store
         self.font_path = None if font_path is None else Path(font_path)
-        self.all_days_range = self._all_days_range()
         self.lang_code = lang_code
-        self.nlp = self._get_nlp()
+        self.nlp_batch_size = nlp_batch_size
+        self.nlp_processes = nlp_processes
+        self.max_senders = max_senders
+        self.top_messages = top_messages
+        self.render_workers = os.cpu_count() if render_workers is None else render_workers
+        self.analysis_workers = os.cpu_count() if analysis_workers is None else analysis_workers
+        self.render_pool = None
+        self.render_lock = threading.Lock()
+        self.render_futures = []
+        self._nlp = None  # Loaded on first tokenization
+        self._nlp_loaded = False
         self.custom_word_filter = set() if custom_word_filter is None else set(custom_word_filter)
         self.strong_pos_filter = strong_pos_filter
+        self.token_store = None
+        self.word_corpus = None
 
     def add_figure(self, fig, category):
-        self.figures[category].append(fig)
+        self.task_figures[getattr(self._task, 'name', None)].append((category, fig))
+
+    def add_file(self, file):
+        self.task_files[getattr(self._task, 'name', None)].append(Path(file).name)
+
+    @property
+    def figures(self):
+        # Figures by category, in the order of the analyses regardless of which finished first
+        return self._by_category(self.task_figures)
+
+    @property
+    def divs(self):
+        return self._by_category(self.task_divs)
+
+    def _by_category(self, task_items):
+        by_category = defaultdict(list)
+        for name in sorted(task_items, key=lambda _: self.analyzed.index(_) if _ in self.analyzed else -1):
+            for category, item in task_items[name]:
+                by_category[category].append(item)
+        return by_category
+
+    @property
+    def counts(self):
+        if self._counts is None:
+            self._counts = aggregate.count_cube(self.df)
+        return self._counts
+
+    @property
+    def all_days_range(self):
+        if self._all_days_range is None:
+            first, last = (self.counts['day'].min(), self.counts['day'].max()) if self.days is None else self.days
+            self._all_days_range = pd.date_range(first, last, freq='D')
+        return self._all_days_range
+
+    @property
+    def plot_senders(self):
+        # Sender of each row in counts, least active senders are merged for figures
+        if self._plot_senders is None:
+            self._plot_senders = aggregate.top_senders(self.counts, self.MAX_PLOT_SENDERS)
+        return self._plot_senders
+
+    @property
+    def text_mask(self):
+        # Rows of non-media messages, used instead of a filtered copy of the frame
+        if self._text_mask is None:
+            self._text_mask = ~self.df['is_media'].values
+        return self._text_mask
+
+    @property
+    def model_name(self):
+        return f'{self.lang_code}_core_web_sm'
+
+    @property
+    def nlp(self):
+        if not self._nlp_loaded:
+            if self.model_name not in self._nlp_models:
+                self._nlp_models[self.model_name] = self._get_nlp()
+            self._nlp = self._nlp_models[self.model_name]
+            self._nlp_loaded = True
+        return self._nlp
 
     def _get_nlp(self):
         print(f'Loading {self.lang_code} language data...')
+        start_time = time.perf_counter()
+        import spacy
         try:
-            return spacy.load(f'{self.lang_code}_core_web_sm')
+            nlp = spacy.load(self.model_name, disable=self.NLP_DISABLED_PIPES)
         except OSError:
-            print(f'Missing data to download. Please run the following command from within your venv: "python -m spacy download {self.lang_code}_core_web_sm"')
-        return None
+            print(f'Missing data to download. Please run the following command from within your venv: "python -m spacy download {self.model_name}"')
+            return None
+        print(f'Loaded {self.model_name} in {time.perf_counter() - start_time:.2f}s')
+        return nlp
 
     @classmethod
     def _get_analyses_map(cls):
         return {
-            'time': [cls.per_day, cls.per_weekday, cls.per_hour],
-            'counts': [cls.per_sender, cls.per_sender_media, cls.common_messages],
-            'cloud': [cls.full_wordcloud, cls.per_sender_wordclouds],
+            'time': ['per_day', 'per_weekday', 'per_hour'],
+            'counts': ['per_sender', 'per_sender_media', 'common_messages'],
+            'cloud': ['full_wordcloud', 'per_sender_wordclouds'],
         }
 
-    def analyze(self, analyses=None):
-        analyses_map = self._get_analyses_map()
+    @classmethod
+    def _get_columns_map(cls):
+        # Time and count figures only need the message counts (see aggregate.count_cube)
+        return {
+            'per_day': [],
+            'per_weekday': [],
+            'per_hour': [],
+            'per_sender': [],
+            'per_sender_media': [],
+            'common_messages': ['sender', 'message', 'is_media'],
+            'full_wordcloud': ['sender', 'message', 'is_media'],
+            'per_sender_wordclouds': ['sender', 'message', 'is_media'],
+        }
+
+    def _get_tasks(self):
+        # Task name: (function, dependencies). Intermediate results are cached by
+        # their functions, so each is computed once and only if a selected analysis needs it.
+        return {
+            # Intermediate results
+            'counts': (lambda: self.counts, []),
+            'days_range': (lambda: self.all_days_range, ['counts']),
+            'plot_senders': (lambda: self.plot_senders, ['counts']),
+            'text_mask': (lambda: self.text_mask, []),
+            'word_corpus': (self._get_word_corpus, ['text_mask']),
+            # Analyses
+            'per_day': (self.per_day, ['days_range', 'plot_senders']),
+            'per_weekday': (self.per_weekday, ['plot_senders']),
+            'per_hour': (self.per_hour, ['days_range', 'plot_senders']),
+            'per_sender': (self.per_sender, ['plot_senders']),
+            'per_sender_media': (self.per_sender_media, ['plot_senders']),
+            'common_messages': (self.common_messages, ['text_mask']),
+            'full_wordcloud': (self.full_wordcloud, ['word_corpus']),
+            'per_sender_wordclouds': (self.per_sender_wordclouds, ['text_mask', 'word_corpus']),
+        }
+
+    @classmethod
+    def _resolve_analyses(cls, analyses):
+        # Categories and individual analyses, as a list of individual analyses
         if not analyses:  # is None or empty list
             analyses = ['all']
-        if 'all' in analyses:
-            analyses = list(analyses_map.keys())
+        analyses_map = cls._get_analyses_map()
+        resolved = []
+        for analysis in analyses:
+            if analysis == 'all':
+                names = list(itertools.chain(*analyses_map.values()))
+            elif analysis in analyses_map:
+                names = analyses_map[analysis]
+            elif analysis in cls._get_columns_map():
+                names = [analysis]
+            else:
+                raise ValueError(f'No such analysis: {analysis}')
+            resolved.extend(_ for _ in names if _ not in resolved)
+        return resolved
+
+    @classmethod
+    def get_required_columns(cls, analyses=None):
+        columns_map = cls._get_columns_map()
+        columns = set()
+        for analysis in cls._resolve_analyses(analyses):
+            columns.update(columns_map[analysis])
+        return columns
+
+    def analyze(self, analyses=None):
+        analyses = self._resolve_analyses(analyses)
         print(f'Analyzing: {", ".join(analyses)}')
-        for analysis_category in analyses:
-            for analysis in analyses_map[analysis_category]:
-                analysis(self)
+        self.analyzed.extend(analyses)
+        if self.memo is not None:
+            analyses = self._restore_analyses(analyses)
+        tasks = {
+            name: (lambda name=name, function=function: self._run_task(name, function), dependencies)
+            for name, (function, dependencies) in self._get_tasks().items()
+        }
+        scheduler.run(tasks, analyses, workers=self.analysis_workers)
+        self._wait_renders()
+        if self.memo is not None:
+            # Analyses with figures are stored on export, with their rendered figures
+            for name in analyses:
+                if not self.task_figures[name]:
+                    self.memo.save(name, self.task_keys[name], self.task_files[name])
+            self.memo.write()
+
+    def _restore_analyses(self, analyses):
+        # Outputs of analyses whose inputs did not change are restored from the
+        # memo, returns the analyses that need to run
+        with profiling.stage('memo.restore'):
+            missing = []
+            for name in analyses:
+                self.task_keys[name] = memo.fingerprint(
+                    self.OUTPUT_VERSION, name, *self._get_memo_inputs(name))
+                restored = self.memo.restore(self.task_keys[name])
+                if restored is None:
+                    missing.append(name)
+                else:
+                    self.task_files[name], self.task_divs[name] = restored
+                    print(f'Unchanged: {name}')
+        return missing
+
+    def _get_memo_inputs(self, analysis):
+        # Data and settings that the output of an analysis depends on
+        if not self._get_columns_map()[analysis]:  # Figures of the message counts
+            return [self._get_input_key('counts', lambda: [self.counts]),
+                self.days, self.MAX_BARS, self.MAX_PLOT_SENDERS]
+        messages = self._get_input_key('messages',
+            lambda: [self.df['message'].values[self.text_mask]])
+        if analysis == 'common_messages':
+            return [messages, self.top_messages]
+        inputs = [
+            messages, tokens.model_id(self.model_name),
+            self.strong_pos_filter, sorted(self.custom_word_filter),
+            self._get_wordcloud_kwargs(),
+        ]
+        if analysis == 'per_sender_wordclouds':
+            inputs += [self.max_senders, self._get_input_key('senders',
+                lambda: [pd.Categorical(self.df['sender'])[self.text_mask]])]
+        return inputs
+
+    def _get_input_key(self, name, get_inputs):
+        if name not in self._input_keys:
+            self._input_keys[name] = memo.fingerprint(*get_inputs())
+        return self._input_keys[name]
+
+    def _run_task(self, name, function):
+        self._task.name = name
+        try:
+            with profiling.stage(f'analysis.{name}') as record:
+                function()
+                if self.task_figures[name]:
+                    record['figures'] = len(self.task_figures[name])
+        finally:
+            self._task.name = None
 
     def export_figures(self):
-        plotly_html.write_css(self.output_folder)
-        for category, figs in self.figures.items():
+        self._write_output('layout.css', memo.fingerprint(plotly_html.CSS),
+            lambda: plotly_html.write_css(self.output_folder))
+        # Figures of analyses that ran are rendered, the others were restored rendered
+        task_figures = [(name, category, fig)
+            for name, figs in self.task_figures.items() for category, fig in figs]
+        executor = None
+        if self.render_workers > 1 and len(task_figures) > 1:
+            executor = ProcessPoolExecutor(max_workers=self.render_workers)
+        with profiling.stage('export.render') as record:
+            divs = (map if executor is None else executor.map)(
+                plotly_html.get_div, [fig for _, _, fig in task_figures])
+            for (name, category, _), div in zip(task_figures, divs):
+                self.task_divs[name].append((category, div))
+            record['figures'] = len(task_figures)
+        if executor is not None:
+            executor.shutdown()
+        self.task_figures.clear()
+        if self.memo is not None:
+            for name in dict.fromkeys(name for name, _, _ in task_figures):
+                self.memo.save(name, self.task_keys[name], self.task_files[name], self.task_divs[name])
+        divs = self.divs
+        if divs:
+            self._write_output(plotly_html.PLOTLYJS_NAME, importlib.metadata.version('plotly'),
+                lambda: plotly_html.write_plotlyjs(self.output_folder))
+        for category, category_divs in divs.items():
             file = self.output_folder / f'{category}.html'
-            plotly_html.write_html(figs, file, title=category.capitalize())
+            title = category.capitalize()
+            key = memo.fingerprint(title, *(self.task_keys.get(name)
+                for name in self.analyzed if any(c == category for c, _ in self.task_divs[name])))
+            with profiling.stage(f'export.{category}') as record:
+                self._write_output(file.name, key,
+                    lambda: plotly_html.write_html(category_divs, file, title=title))
+                record['figures'] = len(category_divs)
+                record['bytes'] = file.stat().st_size
+        if self.memo is not None:
+            self.memo.write()
         print(f'Output data to: {self.output_folder}')
 
-    def _all_days_range(self):
-        raw_days = sorted(self.df.groupby('day').count().index)
-        first_day = arrow.get(raw_days[0])
-        last_day = arrow.get(raw_days[-1])
-        day_range = arrow.Arrow.range('day', first_day, last_day)
-        all_days = [_.format('YYYY-MM-DD') for _ in day_range]
-        return all_days
+    def _write_output(self, name, key, write):
+        # Files that are not memoized by analysis are written unless they are unchanged
+        if self.memo is not None and self.memo.is_current(name, key):
+            print(f'Unchanged: {name}')
+            return
+        write()
+        if self.memo is not None:
+            self.memo.set_output(name, key)
 
     all_weekdays = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
     all_hours = [f'{_:0>2}' for _ in range(24)]
 
     def per_day(self):
+        from plotly import express as px
         print('Analyzing messages by day...')
-        per_day_grouped = self.df.groupby(['day', 'sender']).size()
-        per_day = per_day_grouped.index.to_frame()
-        per_day['messages'] = per_day_grouped
+        # Bars are binned here, so that figure sizes do not grow with the chat length
+        bucket = aggregate.date_bucket(self.all_days_range[0], self.all_days_range[-1], self.MAX_BARS)
+        days = pd.Series(aggregate.bucket_dates(self.counts['day'], bucket), name='day')
+        per_day = self.counts.groupby([days, self.plot_senders], observed=True)['messages'].sum()
+        per_day = per_day.sort_index().reset_index()
         # Figures
-        labels = {'day': 'Date', 'sender': 'Sender'}
-        fig_args = dict(x='day', y='messages', nbins=100, color='sender', labels=labels)
-        fig = px.histogram(per_day, title='Messages per day (stacked)', **fig_args)
-        self.add_figure(fig, 'time')
-        fig = px.histogram(per_day, title='Messages per day', barmode='group', **fig_args)
-        self.add_figure(fig, 'time')
+        labels = {'day': 'Date', 'sender': 'Sender', 'messages': 'Messages'}
+        fig_args = dict(x='day', y='messages', color='sender', labels=labels)
+        _, period = aggregate.DATE_BUCKETS[bucket]
+        with self.plotly_lock:
+            fig = px.bar(per_day, title=f'Messages per {bucket} (stacked)', **fig_args)
+            fig.update_traces(xperiod=period, xperiodalignment='middle')
+            self.add_figure(fig, 'time')
+            fig = px.bar(per_day, title=f'Messages per {bucket}', barmode='group', **fig_args)
+            fig.update_traces(xperiod=period, xperiodalignment='middle')
+            self.add_figure(fig, 'time')
 
     def per_weekday(self):
+        from plotly import express as px
         print('Analyzing messages by weekday...')
-        per_weekday = self.df.groupby(['weekday', 'sender']).size().unstack(level=0)
+        weekday = pd.Series(aggregate.weekdays(self.counts), name='weekday')
+        per_weekday = self.counts.groupby([weekday, self.plot_senders], observed=True)['messages'].sum().sort_index().unstack(level=0)
         per_weekday = per_weekday.reindex(columns=self.all_weekdays)
         per_weekday.fillna(0, inplace=True)
         per_weekday = per_weekday.T
         # Figures
         labels = {'weekday': 'Day', 'sender': 'Sender', 'value': 'Messages'}
-        fig = px.bar(per_weekday, title='Messages per weekday (stacked)', labels=labels)
-        self.add_figure(fig, 'time')
-        fig = px.bar(per_weekday, barmode='group', title='Messages per weekday', labels=labels)
-        self.add_figure(fig, 'time')
+        with self.plotly_lock:
+            fig = px.bar(per_weekday, title='Messages per weekday (stacked)', labels=labels)
+            self.add_figure(fig, 'time')
+            fig = px.bar(per_weekday, barmode='group', title='Messages per weekday', labels=labels)
+            self.add_figure(fig, 'time')
 
     def per_hour(self):
+        from plotly import express as px
         print('Analyzing messages by hour...')
-        per_hour = self.df.groupby(['hour', 'sender']).size().unstack(level=0)
+        per_hour = self.counts.groupby(['hour', self.plot_senders], observed=True)['messages'].sum().sort_index().unstack(level=0)
         per_hour.rename(columns=lambda x: f'{x:0>2}', inplace=True)
         per_hour = per_hour.reindex(columns=self.all_hours)
         per_hour.fillna(0, inplace=True)
@@ -230,63 +707,70 @@ class Analyzer:
         per_hour /= len(self.all_days_range)
         labels = {'hour': 'Hour', 'sender': 'Sender', 'value': 'Messages'}
         # Figures
-        fig = px.bar(per_hour, title='Messages per hour (stacked)', labels=labels)
-        self.add_figure(fig, 'time')
-        fig = px.bar(per_hour, barmode='group', title='Messages per hour', labels=labels)
-        self.add_figure(fig, 'time')
+        with self.plotly_lock:
+            fig = px.bar(per_hour, title='Messages per hour (stacked)', labels=labels)
+            self.add_figure(fig, 'time')
+            fig = px.bar(per_hour, barmode='group', title='Messages per hour', labels=labels)
+            self.add_figure(fig, 'time')
 
     def per_sender(self):
+        from plotly import express as px
         print('Analyzing senders...')
-        msg_per_sender = self.df.groupby('sender').size().to_frame(name='Messages')
+        msg_per_sender = self.counts.groupby(self.plot_senders, observed=True)['messages'].sum().sort_index().to_frame(name='Messages')
         labels = {'sender': 'Sender'}
-        fig = px.pie(
-            msg_per_sender, title='Total messages per person',
-            names=msg_per_sender.index, values='Messages', labels=labels)
-        self.add_figure(fig, 'counts')
+        with self.plotly_lock:
+            fig = px.pie(
+                msg_per_sender, title='Total messages per person',
+                names=msg_per_sender.index, values='Messages', labels=labels)
+            self.add_figure(fig, 'counts')
 
     def per_sender_media(self):
+        from plotly import express as px
         print('Analyzing media messages...')
-        medias = self.df[self.df['is_media']]
-        media_per_sender = medias.groupby('sender').size().to_frame(name='Messages')
-        fig = px.pie(media_per_sender, names=media_per_sender.index, values='Messages', title='Media messages per person')
-        self.add_figure(fig, 'counts')
+        media_per_sender = self.counts.groupby(self.plot_senders, observed=True)['media'].sum().sort_index()
+        media_per_sender = media_per_sender[media_per_sender > 0].to_frame(name='Messages')
+        with self.plotly_lock:
+            fig = px.pie(media_per_sender, names=media_per_sender.index, values='Messages', title='Media messages per person')
+            self.add_figure(fig, 'counts')
 
     def common_messages(self):
         print(f'Analyzing common messages...')
-        message_counts = self.df_nomedia.groupby('message').count()['sender']
-        message_counts = message_counts.sort_values(ascending=False)
-        message_counts = message_counts[message_counts > 1]
+        # Messages are normalized and near-duplicates are counted together, see duplicates.common_messages
+        common = duplicates.common_messages(
+            self.df['message'].values[self.text_mask], top=self.top_messages)
         mc_strs = []
-        for idx, count in message_counts.iteritems():
-            mc_strs.append(f'{count} - {idx}')
+        for count, variants, message in common.itertuples(index=False):
+            variants = f' ({variants} variants)' if variants > 1 else ''
+            mc_strs.append(f'{count} - {message}{variants}')
         util.file_dump(self.output_folder / 'common_messages.txt', '\n'.join(mc_strs))
+        self.add_file('common_messages.txt')
 
     def full_wordcloud(self):
-        all_text = ' '.join(self.df_nomedia['message'])
-        print(f'Generating wordcloud ({len(all_text):,} chars)...')
-        self.generate_wordcloud(all_text, name='all')
+        word_corpus = self._get_word_corpus()
+        if word_corpus is None:
+            return
+        print(f'Generating wordcloud ({self.text_mask.sum():,} messages)...')
+        word_counts = word_corpus.groupby('word')['count'].sum()
+        self.generate_wordcloud(word_counts, name='all')
 
     def per_sender_wordclouds(self):
-        max_senders = 5
-        print(f'Analyzing message contents of top {max_senders} senders...')
-        msg_per_sender = self.df_nomedia.groupby('sender').size().sort_values(ascending=False)
-        print(msg_per_sender)
-        for sender_name in msg_per_sender.index[:max_senders]:
-            all_msgs = self.df_nomedia[self.df_nomedia['sender'] == sender_name]['message']
-            all_text = ' '.join(all_msgs)
-            print(f'Generating wordcloud for {sender_name} ({len(all_text):,} chars)...')
-            self.generate_wordcloud(all_text, name=sender_name.lower())
-
-    def generate_wordcloud(self, text, name):
-        # Tokenize
-        if self.nlp is None:
-            print(f'Missing language data for wordcloud. Please run the following command from within your venv: "python -m spacy download {self.lang_code}_core_web_sm"')
+        word_corpus = self._get_word_corpus()
+        if word_corpus is None:
             return
-        doc = self.nlp(text)
-        words = [token.text.lower() for token in doc if self.interesting_pos(token)]
-        unique_words = set(words)
-        word_counts = Counter(words)
-        # Wordcloud
+        print(f'Analyzing message contents of top {self.max_senders} senders...')
+        senders = self.df['sender'][self.text_mask]
+        msg_per_sender = senders.groupby(senders, observed=True).size().sort_index().sort_values(ascending=False)
+        print(msg_per_sender)
+        top_senders = msg_per_sender.index[:self.max_senders]
+        per_sender = dict(tuple(word_corpus[word_corpus['sender'].isin(top_senders)].groupby('sender')))
+        for sender_name in top_senders:
+            if sender_name not in per_sender:
+                continue
+            word_counts = per_sender[sender_name].set_index('word')['count']
+            print(f'Generating wordcloud for {sender_name} ({msg_per_sender[sender_name]:,} messages)...')
+            self.generate_wordcloud(word_counts, name=sender_name.lower())
+
+    def _get_wordcloud_kwargs(self):
         wc_kwargs = {
             'width': 1200,
             'height': 800,
@@ -294,10 +778,85 @@ class Analyzer:
         }
         if self.font_path is not None and self.font_path.is_file():
             wc_kwargs |= {'font_path': str(self.font_path)}
-        wc = WordCloud(**wc_kwargs).generate_from_frequencies(word_counts)
-        wc.to_file(self.output_folder / f'wordcloud-{name}.png')
+        return wc_kwargs
+
+    def generate_wordcloud(self, word_counts, name):
+        wc_kwargs = self._get_wordcloud_kwargs()
+        file = self.output_folder / f'wordcloud-{name}.png'
+        self.add_file(file)
+        if self.render_workers <= 1:
+            render.render_wordcloud(word_counts.to_dict(), file, wc_kwargs)
+            return
+        with self.render_lock:  # Analyses may run concurrently
+            if self.render_pool is None:
+                self.render_pool = ProcessPoolExecutor(max_workers=self.render_workers)
+            self.render_futures.append(self.render_pool.submit(
+                render.render_wordcloud, word_counts.to_dict(), file, wc_kwargs))
+
+    def _wait_renders(self):
+        if self.render_pool is None:
+            return
+        print(f'Waiting for {len(self.render_futures)} wordclouds to render...')
+        with profiling.stage('render.wait') as record:
+            for future in as_completed(self.render_futures):
+                print(f'Rendered: {future.result()}')
+            record['figures'] = len(self.render_futures)
+        self.render_pool.shutdown()
+        self.render_pool = None
+        self.render_futures = []
 
     # Tokeniation
+    def tokenize(self, messages):
+        return self.nlp.pipe(messages, batch_size=self.nlp_batch_size, n_process=self.nlp_processes)
+
+    def _get_token_store(self):
+        if self.token_store is None:
+            model = tokens.model_id(self.model_name)
+            if model is None:
+                return None
+            self.token_store = tokens.TokenStore.load(self.cache_folder, model)
+        return self.token_store
+
+    def get_token_table(self, messages):
+        # Only messages missing from the token store are tokenized
+        token_store = self._get_token_store()
+        keys = tokens.message_keys(messages)
+        missing = token_store.missing(keys)
+        if missing.any():
+            new_keys, first_index = np.unique(keys[missing], return_index=True)
+            new_messages = np.asarray(messages, dtype=object)[missing][first_index]
+            print(f'Tokenizing {len(new_keys):,} new messages...')
+            with profiling.stage('tokenize') as record:
+                token_count = token_store.offsets[-1]
+                token_store.add(new_keys, self.tokenize(new_messages), self.nlp.vocab.strings)
+                record['messages'] = len(new_keys)
+                record['tokens'] = token_store.offsets[-1] - token_count
+            token_store.save(self.cache_folder)
+        return token_store.get_tokens(keys)
+
+    def _get_word_corpus(self):
+        # Filtered word counts per sender, shared by all wordclouds
+        if self.word_corpus is not None:
+            return self.word_corpus
+        if self._get_token_store() is None:
+            print(f'Missing language data for wordcloud. Please run the following command from within your venv: "python -m spacy download {self.model_name}"')
+            return None
+        token_table = self.get_token_table(self.df['message'].values[self.text_mask])
+        token_table = token_table[self.interesting_pos(token_table)]
+        # Count (sender, lowercase word) pairs by their codes
+        words, word_codes = np.unique(
+            token_table['text'].cat.categories.str.lower(), return_inverse=True)
+        word_codes = word_codes[token_table['text'].cat.codes.values]
+        senders = pd.Categorical(self.df['sender'])
+        sender_codes = senders.codes[self.text_mask][token_table['message'].values].astype(np.int64)
+        pairs, counts = np.unique(sender_codes * len(words) + word_codes, return_counts=True)
+        self.word_corpus = pd.DataFrame({
+            'sender': senders.categories[pairs // len(words)],
+            'word': words[pairs % len(words)],
+            'count': counts,
+        })
+        return self.word_corpus
+
     very_uninteresting_pos = set([
         'NUM', # numeral
         'PUNCT', # punctuation
@@ -314,32 +873,28 @@ class Analyzer:
         'PRON', # pronouns
     ])
 
-    def interesting_pos(self, token):
-        if token.pos_ in self.very_uninteresting_pos:
-            # Filter very uninteresting parts of speech
-            return False
-        if self.strong_pos_filter and token.pos_ in self.uninteresting_pos:
+    def interesting_pos(self, tokens):
+        # Filter the token table from the token store, see TokenStore.get_tokens
+        # Filter very uninteresting parts of speech
+        mask = ~tokens['pos'].isin(self.very_uninteresting_pos)
+        if self.strong_pos_filter:
             # Filter uninteresting parts of speech
-            return False
-        if token.text in self.custom_word_filter:
-            # Filter words from custom filter
-            return False
-        if len(token.shape_) <= 1:
-            # Filter emojis
-            return False
-        if token.tag_ == '_SP':
-            # Filter whitespaces
-            return False
-        return True
+            mask &= ~tokens['pos'].isin(self.uninteresting_pos)
+        # Filter words from custom filter
+        mask &= ~tokens['text'].isin(self.custom_word_filter)
+        # Filter emojis
+        mask &= tokens['shape_len'] > 1
+        # Filter whitespaces
+        mask &= tokens['tag'] != '_SP'
+        return mask
 
     def debug_tokens(self):
-        text = ' '.join(self.df['message'])
-        doc = self.nlp(text)
+        all_tokens = (token for doc in self.tokenize(self.df['message']) for token in doc)
         legend = '\t'.join([
             'text', 'lemma_', 'pos_', 'tag_', 'dep_',
             'shape_', 'is_alpha', 'is_stop'
         ])
-        for i, t in enumerate(doc[:1_000]):
+        for i, t in enumerate(itertools.islice(all_tokens, 1_000)):
             if i % 50 == 0:
                 print('='*30)
                 print(legend)
@@ -354,11 +909,20 @@ class Analyzer:
         ])
 
 
+CACHE_FILES = [
+    Importer.CACHED_DF_NAME, Importer.LEGACY_CACHED_DF_NAME, Importer.CHECKPOINT_NAME,
+    aggregate.FILE_NAME, tokens.TokenStore.FILE_NAME,
+]
+
+
 def main():
+    print(f'Startup time: {time.perf_counter() - STARTUP_TIME:.2f}s')
     arg_space = util.parse_args()
+    if arg_space.profile:
+        profiling.enable(trace_memory=arg_space.trace_memory)
     output_dir = util.resolve_output(arg_space.output,
         clear=arg_space.clear, force_clear=arg_space.force_clear,
-        ignore=[Importer.CACHED_DF_NAME],
+        ignore=CACHE_FILES,
         )
     if arg_space.show_output:
         util.open_file_explorer(output_dir)
@@ -370,18 +934,39 @@ def main():
             print(f'Filtering {len(custom_word_filter)} custom words.')
         else:
             raise FileNotFoundError(f'Cannot find custom word filter file: {arg_space.custom_word_filter}')
-    df = Importer(
+    if arg_space.mode == 'batch':
+        import batch
+        failed = batch.run(arg_space, output_dir, custom_word_filter)
+        profiling.save(output_dir)
+        if failed:
+            raise SystemExit(1)
+        return
+    importer = Importer(
         import_file=arg_space.file, output_folder=output_dir,
         mode=arg_space.mode, line_limit=arg_space.line_limit,
         anonymize_senders=arg_space.anonymize, cache_data=arg_space.cache_data,
-        ).df
-    a = Analyzer(df,
+        batch_size=arg_space.batch_size,
+        columns=Analyzer.get_required_columns(arg_space.analyses),
+        seed=arg_space.seed, anonymize_key=arg_space.anonymize_key,
+        since=query.parse_since(arg_space.since), until=query.parse_until(arg_space.until),
+        senders=arg_space.senders,
+        )
+    if importer.counts.empty:  # e.g. a period without messages
+        print(f'No messages selected, skipping the analyses.')
+        profiling.save(output_dir)
+        return
+    a = Analyzer(importer.df, counts=importer.counts,
         output_folder=output_dir, font_path=arg_space.font_path,
         lang_code=arg_space.lang_code, strong_pos_filter=arg_space.strong_filter,
         custom_word_filter=custom_word_filter,
+        nlp_batch_size=arg_space.nlp_batch_size, nlp_processes=arg_space.nlp_processes,
+        max_senders=arg_space.max_senders, render_workers=arg_space.render_workers,
+        analysis_workers=arg_space.analysis_workers, top_messages=arg_space.top_messages,
+        memo_size=arg_space.memo_size, days=importer.days,
     )
     a.analyze(analyses=arg_space.analyses)
     a.export_figures()
+    profiling.save(output_dir)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+
+MANIFEST_VERSION = 2
+MANIFEST_NAME = 'manifest.json'
+STORE_FOLDER = 'memo'
+FIGURES_NAME = 'figures.json'
+DEFAULT_MAX_MB = 256
+
+
+def fingerprint(*parts):
+    # Hash of arrays, frames and plain values (anything with a stable repr)
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            h.update(fingerprint(*part.columns, *(part[_] for _ in part.columns)).encode())
+        elif isinstance(part, (pd.Series, pd.Index, pd.Categorical, np.ndarray)):
+            if isinstance(getattr(part, 'dtype', None), pd.CategoricalDtype):
+                part = pd.Categorical(part)
+                h.update(fingerprint(part.codes, part.categories.values).encode())
+            elif np.asarray(part).dtype == object:
+                hashes = pd.util.hash_pandas_object(pd.Series(np.asarray(part)), index=False).values
+                h.update(b'object' + hashes.tobytes())
+            else:
+                part = np.ascontiguousarray(part)
+                h.update(f'{part.dtype}{part.shape}'.encode() + part.tobytes())
+        else:
+            h.update(repr(part).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def load_manifest(output_folder):
+    file = output_folder / MANIFEST_NAME
+    if file.is_file():
+        try:
+            manifest = json.loads(file.read_text())
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+        except json.JSONDecodeError:
+            pass
+        print(f'Ignoring unsupported output manifest: {file}')
+    return {'version': MANIFEST_VERSION, 'entries': {}, 'outputs': {}}
+
+
+def clear(output_folder):
+    # Removes the outputs listed in the manifest (of any version) and the stored
+    # entries. Returns the removed file names.
+    try:
+        outputs = json.loads((output_folder / MANIFEST_NAME).read_text()).get('outputs', {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        outputs = {}
+    removed = []
+    for name in outputs:
+        if (output_folder / name).is_file():
+            (output_folder / name).unlink()
+            removed.append(name)
+    shutil.rmtree(output_folder / STORE_FOLDER, ignore_errors=True)
+    (output_folder / MANIFEST_NAME).unlink(missing_ok=True)
+    return removed
+
+
+class Memo:
+    # Outputs of each analysis, stored by the fingerprint of its inputs (the key).
+    # The manifest lists the stored entries and which key each output file is from.
+    def __init__(self, output_folder, max_mb=DEFAULT_MAX_MB):
+        self.output_folder = output_folder
+        self.store = output_folder / STORE_FOLDER
+        self.max_bytes = max_mb * 2**20
+        self.manifest = load_manifest(output_folder)
+        if not self.manifest['entries']:  # Stored entries of an unsupported manifest are unusable
+            shutil.rmtree(self.store, ignore_errors=True)
+
+    def restore(self, key):
+        # Copies the stored files of the key to the output folder, unless they are
+        # already there. Returns the file names and the stored figures, or None if
+        # the key is not stored.
+        entry = self.manifest['entries'].get(key)
+        if entry is None or not all((self.store / key / _).is_file() for _ in entry['files']):
+            return None
+        for name in entry['files']:
+            if not self.is_current(name, key):
+                shutil.copyfile(self.store / key / name, self.output_folder / name)
+        self._set_outputs(entry['task'], key, entry['files'])
+        entry['last_used'] = time.time()
+        figures = []
+        if entry['figures']:
+            figures = json.loads((self.store / key / FIGURES_NAME).read_text())
+        return list(entry['files']), [tuple(_) for _ in figures]
+
+    def save(self, task, key, files, figures=()):
+        # Stores output files (names in the output folder) and (category, div) figures
+        folder = self.store / key
+        folder.mkdir(parents=True, exist_ok=True)
+        for name in files:
+            shutil.copyfile(self.output_folder / name, folder / name)
+        if figures:
+            (folder / FIGURES_NAME).write_text(json.dumps(list(figures)))
+        size = sum(_.stat().st_size for _ in folder.iterdir())
+        self.manifest['entries'][key] = {
+            'task': task,
+            'files': list(files),
+            'figures': len(figures),
+            'bytes': size,
+            'last_used': time.time(),
+        }
+        self._set_outputs(task, key, files)
+
+    def is_current(self, name, key):
+        # The output file must also not have changed since, e.g. by a run without the memo
+        output = self.manifest['outputs'].get(name)
+        return output is not None and output['key'] == key and output['stat'] == self._stat(name)
+
+    def set_output(self, name, key):
+        # After the output file is written
+        self.manifest['outputs'][name] = {'key': key, 'stat': self._stat(name)}
+
+    def _stat(self, name):
+        try:
+            stat = (self.output_folder / name).stat()
+        except FileNotFoundError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _set_outputs(self, task, key, files):
+        # Files of an earlier key of the same task are removed if they are not produced anymore
+        for name, output in list(self.manifest['outputs'].items()):
+            old_entry = self.manifest['entries'].get(output['key'])
+            if old_entry is not None and old_entry['task'] == task and name not in files:
+                (self.output_folder / name).unlink(missing_ok=True)
+                del self.manifest['outputs'][name]
+        for name in files:
+            self.set_output(name, key)
+
+    def write(self):
+        self.evict()
+        file = self.output_folder / MANIFEST_NAME
+        temp_file = file.with_suffix('.tmp')
+        temp_file.write_text(json.dumps(self.manifest, indent=4))
+        os.replace(temp_file, file)
+
+    def evict(self):
+        # Least recently used entries beyond the size limit, except those of the current outputs
+        entries = self.manifest['entries']
+        current = {_['key'] for _ in self.manifest['outputs'].values()}
+        total = sum(_['bytes'] for _ in entries.values())
+        for key in sorted(entries, key=lambda _: entries[_]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key in current:
+                continue
+            total -= entries.pop(key)['bytes']
+            shutil.rmtree(self.store / key, ignore_errors=True)
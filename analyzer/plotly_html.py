@@ -1,10 +1,13 @@
+PLOTLYJS_NAME = 'plotly.min.js'
+
 
 def write_html(figures, file, title='Plots', light=False):
-    first_div = figures[0].to_html(full_html=False, include_plotlyjs='cdn' if light else True)
-    divs = [first_div]+[fig.to_html(full_html=False, include_plotlyjs=False) for fig in figures[1:]]
-    body = '\n'.join(get_part(_) for _ in divs)
+    # Figures may be rendered divs already (see get_div)
     with open(file, 'w') as f:
-        f.write(get_body(title, body))
+        f.write(get_head(title, light))
+        for fig in figures:
+            f.write(get_part(get_div(fig)))
+        f.write(BODY2)
 
 
 def write_css(output_dir):
@@ -12,9 +15,28 @@ def write_css(output_dir):
         f.write(CSS)
 
 
-def get_body(title, body):
-    body_title = BODY1.replace('<title></title>', f'<title>{title}</title>')
-    return '\n'.join([body_title, body, BODY2])
+def write_plotlyjs(output_dir):
+    # Shared by all html files in the output folder
+    from plotly.offline import get_plotlyjs
+    with open(output_dir / PLOTLYJS_NAME, 'w', encoding='utf-8') as f:
+        f.write(get_plotlyjs())
+
+
+def get_div(fig):
+    if isinstance(fig, str):  # Already rendered
+        return fig
+    return fig.to_html(full_html=False, include_plotlyjs=False)
+
+
+def get_head(title, light=False):
+    if light:
+        from plotly.offline import get_plotlyjs_version
+        src = f'https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js'
+    else:
+        src = PLOTLYJS_NAME
+    script = f'<script src="{src}" charset="utf-8"></script>'
+    head = BODY1.replace('</head>', f'{script}\n</head>')
+    return head.replace('<title></title>', f'<title>{title}</title>')
 
 
 def get_part(div):
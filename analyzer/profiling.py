@@ -0,0 +1,144 @@
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+FILE_NAME = 'profile.json'
+REPORT_VERSION = 1
+# Counts that stages may record, their throughput is added to the report
+COUNTS = ['lines', 'rows', 'messages', 'tokens', 'figures', 'bytes']
+
+_enabled = False
+_start_time = None
+_start_cpu = None
+_stages = []
+_open_stages = 0  # In all threads, the traced peak is only reset when no stage is open
+_lock = threading.Lock()
+
+
+def enable(trace_memory=False):
+    # Also called in worker processes, which may have been forked with stages open
+    global _enabled, _start_time, _start_cpu, _stages, _open_stages, _lock
+    _enabled = True
+    _start_time = time.perf_counter()
+    _start_cpu = time.process_time()
+    _stages = []
+    _open_stages = 0
+    _lock = threading.Lock()
+    if trace_memory:
+        tracemalloc.start()
+
+
+def is_enabled():
+    return _enabled
+
+
+@contextmanager
+def stage(name):
+    # Records wall time, cpu time and memory of the enclosed code. Yields a dict
+    # to which the stage may add counts (see COUNTS) for throughput. The traced
+    # peak is only recorded for stages that start when no other stage is open,
+    # nested and concurrent stages would reset it.
+    global _open_stages
+    record = {}
+    if not _enabled:
+        yield record
+        return
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    start_rss = _peak_rss()
+    with _lock:
+        top_level = _open_stages == 0
+        _open_stages += 1
+        if tracemalloc.is_tracing():
+            start_traced, _ = tracemalloc.get_traced_memory()
+            if top_level:
+                tracemalloc.reset_peak()
+    try:
+        yield record
+    finally:
+        with _lock:
+            _open_stages -= 1
+        wall = time.perf_counter() - start_wall
+        result = {
+            'name': name,
+            'start': round(start_wall - _start_time, 6),
+            'wall': round(wall, 6),
+            'cpu': round(time.process_time() - start_cpu, 6),
+        }
+        if resource is not None:
+            result['peak_rss_mb'] = round(_peak_rss() / 2**20, 3)
+            result['peak_rss_growth_mb'] = round((_peak_rss() - start_rss) / 2**20, 3)
+        if tracemalloc.is_tracing():
+            traced, traced_peak = tracemalloc.get_traced_memory()
+            result['traced_delta_mb'] = round((traced - start_traced) / 2**20, 3)
+            if top_level:
+                result['traced_peak_mb'] = round((traced_peak - start_traced) / 2**20, 3)
+        for count in COUNTS:
+            if count in record:
+                result[count] = int(record[count])
+                result[f'{count}_per_sec'] = round(record[count] / max(wall, 1e-9), 1)
+        _stages.append(result)
+
+
+def take_stages():
+    # Returns the recorded stages and forgets them, e.g. to pass them from a worker process
+    global _stages
+    stages, _stages = _stages, []
+    return stages
+
+
+def add_stages(stages, **fields):
+    # Stages recorded elsewhere (e.g. by a worker process), with fields to tell them apart
+    if _enabled:
+        _stages.extend(_ | fields for _ in stages)
+
+
+def save(output_folder):
+    if not _enabled:
+        return
+    report = {
+        'version': REPORT_VERSION,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'argv': sys.argv,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'wall': round(time.perf_counter() - _start_time, 6),
+        'cpu': round(time.process_time() - _start_cpu, 6),
+        'children_cpu': round(os.times().children_user + os.times().children_system, 6),
+        'stages': _stages,
+    }
+    if resource is not None:
+        report['peak_rss_mb'] = round(_peak_rss() / 2**20, 3)
+    file = output_folder / FILE_NAME
+    with open(file, 'w') as f:
+        json.dump(report, f, indent=4)
+    print_summary(report)
+    print(f'Profile report at: {file}')
+
+
+def print_summary(report):
+    print(f'{"Stage":<40}{"Wall (s)":>10}{"CPU (s)":>10}{"Peak RSS (MB)":>15}')
+    for s in report['stages']:
+        name = s['name'] if 'chat' not in s else f'{s["name"]} ({s["chat"]})'
+        print(f'{name:<40}{s["wall"]:>10.3f}{s["cpu"]:>10.3f}{s.get("peak_rss_mb", 0):>15.1f}')
+    print(f'{"Total":<40}{report["wall"]:>10.3f}{report["cpu"]:>10.3f}{report.get("peak_rss_mb", 0):>15.1f}')
+
+
+def _peak_rss():
+    # Bytes, ru_maxrss is in kilobytes on linux and in bytes on macos
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
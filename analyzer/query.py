@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+
+def parse_since(value):
+    return None if value is None else pd.Timestamp(value)
+
+
+def parse_until(value):
+    # A date without a time includes the whole day, month or year (e.g. 2022-01),
+    # a time is an exact bound. The returned bound is exclusive.
+    if value is None:
+        return None
+    period = pd.Period(value)
+    until = (period + 1).start_time
+    if until - period.start_time < pd.Timedelta(days=1):
+        return pd.Timestamp(value)
+    return until
+
+
+def date_rows(dates, since=None, until=None):
+    # Slice of the rows from since (inclusive) to until (exclusive), dates must be sorted
+    dates = np.asarray(dates).astype('datetime64[ns]', copy=False)
+    start = 0 if since is None else np.searchsorted(dates, np.datetime64(since, 'ns'), side='left')
+    stop = len(dates) if until is None else np.searchsorted(dates, np.datetime64(until, 'ns'), side='left')
+    return slice(int(start), int(max(start, stop)))
+
+
+def period_days(first, last, since=None, until=None):
+    # First and last day of the period from since to until (exclusive), within
+    # the first and last date of the chat
+    first, last = pd.Timestamp(first).normalize(), pd.Timestamp(last).normalize()
+    if since is not None:
+        first = max(first, pd.Timestamp(since).normalize())
+    if until is not None:
+        last = min(last, (pd.Timestamp(until) - pd.Timedelta(1, 'ns')).normalize())
+    return first, last
+
+
+def is_sorted(dates):
+    dates = np.asarray(dates)
+    return bool(np.all(dates[1:] >= dates[:-1]))
+
+
+def filter_frame(df, since=None, until=None, senders=None):
+    # Messages of the period and senders, the period is a slice of the date sorted frame
+    if since is not None or until is not None:
+        df = df.iloc[date_rows(df['date'].values, since, until)]
+    if senders:
+        df = df[df['sender'].isin(check_senders(df['sender'], senders)).values]
+    return df
+
+
+def check_senders(sender_column, senders):
+    known = set(sender_column.cat.categories)
+    unknown = [_ for _ in senders if _ not in known]
+    if unknown:
+        raise ValueError(f'No such sender: {", ".join(unknown)} (senders: {", ".join(sorted(known))})')
+    return senders
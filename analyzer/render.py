@@ -0,0 +1,6 @@
+def render_wordcloud(word_counts, file, wc_kwargs):
+    # Runs in a worker process, takes only plain frequencies and settings
+    from wordcloud import WordCloud
+    wc = WordCloud(**wc_kwargs).generate_from_frequencies(word_counts)
+    wc.to_file(file)
+    return file
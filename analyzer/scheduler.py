@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def resolve(tasks, targets):
+    # Targets and every task they depend on, each after its dependencies
+    order = []
+    def visit(name, path):
+        if name in path:
+            raise ValueError(f'Circular task dependency: {" -> ".join(path + (name,))}')
+        if name in order:
+            return
+        for dependency in tasks[name][1]:
+            visit(dependency, path + (name,))
+        order.append(name)
+    for target in targets:
+        visit(target, ())
+    return order
+
+
+def run(tasks, targets, workers=1):
+    # Tasks map a name to a (function, dependencies) pair. Every task needed by
+    # the targets runs once, as soon as its dependencies are done, with up to
+    # workers tasks running concurrently.
+    order = resolve(tasks, targets)
+    if workers <= 1:
+        for name in order:
+            tasks[name][0]()
+        return order
+    pending = list(order)
+    running = {}
+    done = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            ready = [_ for _ in pending if all(d in done for d in tasks[_][1])]
+            for name in ready:
+                pending.remove(name)
+                running[executor.submit(tasks[name][0])] = name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                future.result()  # Raises the task's exception, if any
+                done.add(running.pop(future))
+    return order
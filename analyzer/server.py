@@ -0,0 +1,199 @@
+import asyncio
+import json
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import memo
+import query
+import tokens
+import util
+from client import DEFAULT_PORT, HOST
+from main import Analyzer, Importer
+
+
+COMMANDS = ['analyze', 'status', 'reload', 'shutdown']
+
+
+class Server:
+    # Keeps a cached chat, its counts and the language model loaded between
+    # requests. Requests are json lines, each answered with a json line (see client.py).
+    def __init__(self, output_folder, anonymize_senders=True, anonymize_key=None, analyzer_kwargs=None):
+        self.output_folder = output_folder
+        self.anonymize_senders = anonymize_senders
+        self.anonymize_key = anonymize_key
+        self.analyzer_kwargs = {} if analyzer_kwargs is None else analyzer_kwargs
+        self.start_time = time.time()
+        self.df = None
+        self.counts = None
+        self.token_store = None
+        self.stopped = asyncio.Event()
+        # Analyses run one at a time, the loop stays free to answer other requests
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def load(self):
+        importer = Importer(output_folder=self.output_folder, mode='cached',
+            anonymize_senders=self.anonymize_senders, anonymize_key=self.anonymize_key)
+        self.df, self.counts = importer.df, importer.counts
+        self.token_store = None
+
+    def warm_up(self):
+        # Libraries and the language model are loaded before the first request,
+        # render processes are forked with them loaded
+        from plotly import express
+        from wordcloud import WordCloud
+        analyzer = self.get_analyzer(self.df, self.counts, self.output_folder)
+        if tokens.model_id(analyzer.model_name) is not None:
+            analyzer.nlp
+
+    def get_analyzer(self, df, counts, output_folder, days=None):
+        analyzer = Analyzer(df, output_folder, counts=counts, days=days,
+            cache_folder=self.output_folder, **self.analyzer_kwargs)
+        analyzer.token_store = self.token_store  # Loaded once, messages are tokenized once
+        return analyzer
+
+    def analyze(self, request):
+        start_time = time.perf_counter()
+        output_folder = self.get_output_folder(request.get('output'))
+        since = query.parse_since(request.get('since'))
+        until = query.parse_until(request.get('until'))
+        senders = request.get('senders')
+        df = query.filter_frame(self.df, since=since, until=until, senders=senders)
+        counts = self.counts if len(df.index) == len(self.df.index) else None
+        files, senders = [], {}
+        if df.empty:
+            print(f'No messages selected, skipping the analyses.')
+        else:
+            days = None
+            if since is not None or until is not None:
+                days = query.period_days(self.df['date'].iloc[0], self.df['date'].iloc[-1], since=since, until=until)
+            analyzer = self.get_analyzer(df, counts, output_folder, days=days)
+            analyzer.analyze(analyses=request.get('analyses'))
+            analyzer.export_figures()
+            self.token_store = analyzer.token_store
+            files = sorted({name for names in analyzer.task_files.values() for name in names}
+                | {f'{category}.html' for category in analyzer.divs})
+            sender_counts = analyzer.counts.groupby('sender', observed=True)['messages'].sum()
+            senders = {str(k): int(v) for k, v in sender_counts[sender_counts > 0].items()}
+        return {
+            'output': str(output_folder),
+            'files': files,
+            'messages': int(len(df.index)),
+            'first': None if df.empty else str(df['date'].iloc[0]),
+            'last': None if df.empty else str(df['date'].iloc[-1]),
+            'senders': senders,
+            'seconds': round(time.perf_counter() - start_time, 3),
+        }
+
+    def status(self):
+        return {
+            'output': str(self.output_folder),
+            'messages': int(len(self.df.index)),
+            'first': None if self.df.empty else str(self.df['date'].iloc[0]),
+            'last': None if self.df.empty else str(self.df['date'].iloc[-1]),
+            'senders': sorted(str(_) for _ in self.df['sender'].cat.categories),
+            'uptime': round(time.time() - self.start_time, 3),
+        }
+
+    def get_output_folder(self, name):
+        # Requests may name a subfolder of the output folder
+        if not name:
+            return self.output_folder
+        folder = (self.output_folder / name).resolve()
+        if self.output_folder.resolve() not in folder.parents:
+            raise ValueError(f'Output must be a subfolder of {self.output_folder}: {name}')
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder
+
+    async def handle_request(self, request):
+        command = request.get('command', 'analyze')
+        if command not in COMMANDS:
+            raise ValueError(f'No such command: {command} (commands: {", ".join(COMMANDS)})')
+        loop = asyncio.get_running_loop()
+        if command == 'status':
+            return self.status()
+        if command == 'shutdown':
+            self.stopped.set()
+            return {}
+        if command == 'reload':
+            await loop.run_in_executor(self.executor, self.load)
+            return self.status()
+        return await loop.run_in_executor(self.executor, self.analyze, request)
+
+    async def handle_client(self, reader, writer):
+        while line := await reader.readline():
+            try:
+                request = json.loads(line)
+                response = {'ok': True} | await self.handle_request(request)
+            except Exception as e:
+                response = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+        writer.close()
+
+    async def serve(self, port=DEFAULT_PORT, socket_path=None):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.load)
+        await loop.run_in_executor(self.executor, self.warm_up)
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_client, path=socket_path)
+            print(f'Serving {self.output_folder} on {socket_path}')
+        else:
+            server = await asyncio.start_server(self.handle_client, host=HOST, port=port)
+            print(f'Serving {self.output_folder} on {HOST}:{port}')
+        async with server:
+            await self.stopped.wait()
+        if socket_path is not None:
+            Path(socket_path).unlink(missing_ok=True)
+        self.executor.shutdown()
+        print('Server stopped.')
+
+
+def main():
+    parser = ArgumentParser(description='Serve analyses of a cached chat, keeping it and the language model loaded.')
+    parser.add_argument('-o', dest='output', type=Path, required=True,
+        help='Output folder of a cached chat (see --cache)')
+    parser.add_argument('--port', dest='port', type=int, default=DEFAULT_PORT,
+        help=f'Port on {HOST} to serve on (default: {DEFAULT_PORT})')
+    parser.add_argument('--socket', dest='socket', type=Path, default=None,
+        help='Unix socket to serve on instead of a port')
+    parser.add_argument('--no-anon', dest='anonymize', action='store_false',
+        help='Disable sender anonymization')
+    parser.add_argument('--anon-key', dest='anonymize_key', type=str, default=None,
+        help='Key for deterministic anonymization')
+    parser.add_argument('-l', dest='lang_code', type=str, default='en',
+        help='Analysis language code')
+    parser.add_argument('--soft-filter', dest='strong_filter', action='store_false',
+        help='Apply a softer filter for wordcloud words')
+    parser.add_argument('--custom-filter', dest='custom_word_filter', type=Path, default=None,
+        help='Supply a file with words to filter')
+    parser.add_argument('--font', dest='font_path', type=Path, default=None,
+        help='Path to font to use for output')
+    parser.add_argument('--max-senders', dest='max_senders', type=int, default=5,
+        help='Number of most active senders to generate wordclouds for')
+    parser.add_argument('--top-messages', dest='top_messages', type=int, default=1000,
+        help='Number of most common messages to list')
+    parser.add_argument('--render-workers', dest='render_workers', type=int, default=None,
+        help='Number of processes to render wordclouds and figures with (default: number of cores)')
+    parser.add_argument('--memo-size', dest='memo_size', type=int, default=memo.DEFAULT_MAX_MB,
+        help='Megabytes of earlier outputs to keep (0 to disable)')
+    args = parser.parse_args()
+    custom_word_filter = None
+    if args.custom_word_filter is not None:
+        custom_word_filter = set(util.file_load(args.custom_word_filter).split())
+    server = Server(args.output,
+        anonymize_senders=args.anonymize, anonymize_key=args.anonymize_key,
+        analyzer_kwargs=dict(
+            font_path=args.font_path, lang_code=args.lang_code,
+            strong_pos_filter=args.strong_filter, custom_word_filter=custom_word_filter,
+            max_senders=args.max_senders, top_messages=args.top_messages,
+            render_workers=args.render_workers, memo_size=args.memo_size,
+        ))
+    try:
+        asyncio.run(server.serve(port=args.port, socket_path=args.socket))
+    except KeyboardInterrupt:
+        print('Server stopped.')
+
+
+if __name__ == '__main__':
+    main()
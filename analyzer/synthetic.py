@@ -0,0 +1,106 @@
+import itertools
+from argparse import ArgumentParser
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import util
+import whatsapp
+
+
+MINUTE_NS = 60 * 10**9
+
+
+def generate_chat(message_count, seed=None, senders=None, sender_count=5,
+        days=28, end_date=None, mean_words=6, max_words=40,
+        media_ratio=0.05, multiline_ratio=0.02,
+    ):
+    rng = np.random.default_rng(seed)
+    if senders is None:
+        senders = _sender_names(sender_count)
+    # Dates, sorted like a real chat and rounded to the minute like whatsapp exports
+    end_date = pd.Timestamp.now() if end_date is None else pd.Timestamp(end_date)
+    end_minute = end_date.value // MINUTE_NS
+    minutes = np.sort(end_minute - rng.integers(0, days * 24 * 60, size=message_count))
+    dates = (minutes * MINUTE_NS).view('datetime64[ns]')
+    # Senders, with a skewed activity like most group chats
+    weights = 1 / np.arange(1, len(senders) + 1)
+    codes = rng.choice(len(senders), size=message_count, p=weights / weights.sum())
+    sender = pd.Categorical.from_codes(codes, categories=senders)
+    messages = _generate_messages(rng, message_count, mean_words, max_words, multiline_ratio)
+    messages[rng.random(message_count) < media_ratio] = whatsapp.MEDIA_MESSAGE
+    return pd.DataFrame({'date': dates, 'sender': sender, 'message': messages})
+
+
+def write_whatsapp(file, chat_df, batch_size=100_000):
+    # Format each unique minute once, then write the lines in batches
+    minutes, inverse = np.unique(chat_df['date'].values, return_inverse=True)
+    minutes = pd.DatetimeIndex(minutes)
+    headers = np.array([
+        f'{m}/{d}/{y % 100:02}, {h:02}:{mi:02}' for m, d, y, h, mi in zip(
+            minutes.month, minutes.day, minutes.year, minutes.hour, minutes.minute)
+    ], dtype=object)[inverse]
+    senders = chat_df['sender'].astype(object).values
+    messages = chat_df['message'].values
+    with open(file, 'w', encoding='utf-8') as f:
+        for start in range(0, len(messages), batch_size):
+            batch = zip(*(_[start:start+batch_size] for _ in (headers, senders, messages)))
+            lines = '\n'.join(f'{h} - {s}: {m}' for h, s, m in batch)
+            f.write(lines if start == 0 else f'\n{lines}')
+
+
+def _sender_names(sender_count):
+    names = util.CRYPTO_NAMES[:sender_count]
+    return names + [f'Sender {i}' for i in range(len(names), sender_count)]
+
+
+def _generate_messages(rng, message_count, mean_words, max_words, multiline_ratio):
+    # Draw every word at once, then join them into messages with a single str.join
+    lengths = np.minimum(rng.geometric(1 / mean_words, size=message_count), max_words)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    words = np.array(util.LOREM_IPSUM_WORDS, dtype=object)
+    tokens = words[rng.integers(0, len(words), size=ends[-1] if message_count else 0)]
+    tokens[starts] = np.array([_.capitalize() for _ in words], dtype=object)[
+        rng.integers(0, len(words), size=message_count)]
+    separators = np.full(len(tokens), ' ', dtype=object)
+    separators[ends - 1] = '\0'
+    multiline = (rng.random(message_count) < multiline_ratio) & (lengths > 1)
+    breaks = starts[multiline] + rng.integers(0, lengths[multiline] - 1)
+    separators[breaks] = '\n'
+    text = ''.join(itertools.chain.from_iterable(zip(tokens, separators)))
+    return np.array(text.split('\0')[:-1], dtype=object)
+
+
+def main():
+    parser = ArgumentParser(description='Generate a synthetic chat in whatsapp export format.')
+    parser.add_argument('-n', dest='message_count', type=int, default=100_000,
+        help='Number of messages to generate')
+    parser.add_argument('-o', dest='output', type=Path, required=True,
+        help='File to write the chat to')
+    parser.add_argument('--seed', dest='seed', type=int, default=None,
+        help='Random seed')
+    parser.add_argument('--senders', dest='sender_count', type=int, default=5,
+        help='Number of senders')
+    parser.add_argument('--days', dest='days', type=int, default=365,
+        help='Number of days the chat spans')
+    parser.add_argument('--end-date', dest='end_date', type=str, default=None,
+        help='Date of the last message (default: now)')
+    parser.add_argument('--mean-words', dest='mean_words', type=float, default=6,
+        help='Mean number of words per message')
+    parser.add_argument('--max-words', dest='max_words', type=int, default=40,
+        help='Maximum number of words per message')
+    parser.add_argument('--media-ratio', dest='media_ratio', type=float, default=0.05,
+        help='Fraction of media messages')
+    parser.add_argument('--multiline-ratio', dest='multiline_ratio', type=float, default=0.02,
+        help='Fraction of multi-line messages')
+    args = parser.parse_args()
+    chat_df = generate_chat(args.message_count, seed=args.seed,
+        sender_count=args.sender_count, days=args.days, end_date=args.end_date,
+        mean_words=args.mean_words, max_words=args.max_words,
+        media_ratio=args.media_ratio, multiline_ratio=args.multiline_ratio)
+    write_whatsapp(args.output, chat_df)
+    print(f'Wrote {len(chat_df.index):,} messages to: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
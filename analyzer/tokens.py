@@ -0,0 +1,117 @@
+import importlib.metadata
+import numpy as np
+import pandas as pd
+import cache
+
+
+STORE_VERSION = 1
+TOKEN_ATTRS = ['text', 'pos', 'tag']
+
+
+def message_keys(messages):
+    return pd.util.hash_pandas_object(pd.Series(messages, dtype=object), index=False).values
+
+
+def model_id(model_name):
+    # Identifies the installed model without loading it, or None if not installed
+    try:
+        return f'{model_name}-{importlib.metadata.version(model_name)}'
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+class TokenStore:
+    # Tokens of every message ever tokenized, keyed by a hash of the message
+    FILE_NAME = 'cached_tokens.npz'
+
+    def __init__(self, model):
+        self.model = model
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.codes = {attr: np.empty(0, dtype=np.int32) for attr in TOKEN_ATTRS}
+        self.shape_len = np.empty(0, dtype=np.uint8)
+        self.vocabs = {attr: [] for attr in TOKEN_ATTRS}
+        self._key_index = None
+        self._vocab_index = None
+
+    @classmethod
+    def load(cls, folder, model):
+        file = folder / cls.FILE_NAME
+        store = cls(model)
+        if not file.is_file():
+            return store
+        with np.load(file) as npz:
+            if int(npz['version']) != STORE_VERSION or str(npz['model']) != model:
+                print(f'Ignoring token cache from a different language model: {file}')
+                return store
+            store.keys = npz['keys']
+            store.offsets = npz['offsets']
+            store.codes = {attr: npz[f'{attr}.codes'] for attr in TOKEN_ATTRS}
+            store.shape_len = npz['shape_len']
+            store.vocabs = {attr: cache.decode_strings(npz, f'{attr}.vocab') for attr in TOKEN_ATTRS}
+        return store
+
+    def save(self, folder):
+        arrays = {
+            'version': np.array(STORE_VERSION),
+            'model': np.array(self.model),
+            'keys': self.keys,
+            'offsets': self.offsets,
+            'shape_len': self.shape_len,
+        }
+        for attr in TOKEN_ATTRS:
+            arrays[f'{attr}.codes'] = self.codes[attr]
+            arrays |= cache.encode_strings(f'{attr}.vocab', self.vocabs[attr])
+        with open(folder / self.FILE_NAME, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def missing(self, keys):
+        return self._get_key_index().get_indexer(keys) < 0
+
+    def add(self, keys, docs, strings):
+        from spacy.attrs import ORTH, POS, TAG, SHAPE
+        arrays = [doc.to_array([ORTH, POS, TAG, SHAPE]) for doc in docs]
+        lengths = np.fromiter(map(len, arrays), dtype=np.int64, count=len(arrays))
+        table = np.concatenate(arrays) if arrays else np.empty((0, 4), dtype=np.uint64)
+        # Resolve each unique string hash once
+        for i, attr in enumerate(TOKEN_ATTRS):
+            hashes, inverse = np.unique(table[:, i], return_inverse=True)
+            codes = np.array([self._get_code(attr, strings[int(_)]) for _ in hashes], dtype=np.int32)
+            self.codes[attr] = np.concatenate([self.codes[attr], codes[inverse]])
+        shapes, inverse = np.unique(table[:, 3], return_inverse=True)
+        shape_len = np.array([min(len(strings[int(_)]), 255) for _ in shapes], dtype=np.uint8)
+        self.shape_len = np.concatenate([self.shape_len, shape_len[inverse]])
+        self.keys = np.concatenate([self.keys, keys])
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+        self._key_index = None
+
+    def get_tokens(self, keys):
+        # One row per token of each message in keys, messages are referred to by position
+        positions = self._get_key_index().get_indexer(keys)
+        if (positions < 0).any():
+            raise KeyError('Messages missing from token cache')
+        starts = self.offsets[positions]
+        lengths = self.offsets[positions + 1] - starts
+        message = np.repeat(np.arange(len(positions)), lengths)
+        token_index = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        tokens = {'message': message}
+        for attr in TOKEN_ATTRS:
+            tokens[attr] = pd.Categorical.from_codes(
+                self.codes[attr][token_index], categories=self.vocabs[attr])
+        tokens['shape_len'] = self.shape_len[token_index]
+        return pd.DataFrame(tokens)
+
+    def _get_key_index(self):
+        if self._key_index is None:
+            self._key_index = pd.Index(self.keys)
+        return self._key_index
+
+    def _get_code(self, attr, string):
+        if self._vocab_index is None:
+            self._vocab_index = {
+                attr: {s: i for i, s in enumerate(vocab)} for attr, vocab in self.vocabs.items()}
+        index = self._vocab_index[attr]
+        if string not in index:
+            index[string] = len(self.vocabs[attr])
+            self.vocabs[attr].append(string)
+        return index[string]
@@ -1,12 +1,17 @@
 import os, platform, subprocess
 import hashlib
-import random
-import arrow
+import hmac
+import numpy as np
+import memo
 from argparse import ArgumentParser
 from pathlib import Path
 
 
+KEYED_ALIAS_VERSION = 2  # Of the format of keyed_alias
 CRYPTO_NAMES = ['Alice', 'Bob', 'Carol', 'Dave', 'Eve', 'Frank', 'Grace', 'Ivan', 'Judy', 'Mike', 'Niaj', 'Olivia', 'Peggy', 'Rupert', 'Sybil', 'Ted', 'Victor', 'Wendy']
+WEEKDAY_NAMES = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], dtype=object)
+HOUR_NS = 3600 * 10**9
+DAY_NS = 24 * HOUR_NS
 LOREM_IPSUM = """cursus nibh velit venenatis est habitasse lectus odio aliquet metus varius nec habitant quis sodales dictumst euismod imperdiet ultrices mollis senectus himenaeos cursus hendrerit non quisque platea egestas viverra nam diam eget inceptos duis magna vulputate suspendisse neque pulvinar tempus sagittis aliquet libero blandit vivamus est pellentesque egestas laoreet auctor porta arcu consequat nullam"""
 LOREM_IPSUM_WORDS = list(LOREM_IPSUM.split(' '))
 
@@ -16,25 +21,49 @@ def parse_args():
     parser.add_argument(
         '-m', dest='mode',
         type=str, default='randomgen',
-        help='Type of import, one of: randomgen, cached, whatsapp')
+        help='Type of import, one of: randomgen, cached, whatsapp, batch (whatsapp chats in a folder or glob)')
     parser.add_argument(
         '-f', dest='file',
         type=Path, default=None,
-        help='File to import and analyze')
+        help='File to import and analyze, or a folder or glob of chats in batch mode')
     parser.add_argument(
         '--line-limit', dest='line_limit',
         type=int, default=0,
         help='Maximum number of lines to import from file')
+    parser.add_argument(
+        '--seed', dest='seed',
+        type=int, default=None,
+        help='Random seed for generating random data')
+    parser.add_argument(
+        '--batch-size', dest='batch_size',
+        type=int, default=100_000,
+        help='Number of messages to parse at a time when importing from file')
     parser.add_argument(
         '--no-anon', dest='anonymize', action='store_false',
         help='Disable sender anonymization')
+    parser.add_argument(
+        '--anon-key', dest='anonymize_key',
+        type=str, default=None,
+        help='Key for deterministic anonymization, senders get the same alias with the same key')
     parser.add_argument(
         '--cache', dest='cache_data', action='store_true',
         help='Cache imported data')
+    parser.add_argument(
+        '--since', dest='since',
+        type=str, default=None,
+        help='Analyze messages from this date or time, e.g. 2022-01-01 or "2022-01-01 18:00"')
+    parser.add_argument(
+        '--until', dest='until',
+        type=str, default=None,
+        help='Analyze messages up to this date, month or year (inclusive, e.g. 2022-01) or time')
+    parser.add_argument(
+        '--sender', dest='senders',
+        type=str, default=None, nargs='*',
+        help='Analyze only messages of these senders (as named in the output)')
     parser.add_argument(
         '-a', dest='analyses',
         type=str, default='', nargs='*',
-        help='Analyses, any combination of: all, time, counts, cloud')
+        help='Analyses, any combination of: all, time, counts, cloud, or individual analyses (e.g. per_day, common_messages)')
     parser.add_argument(
         '-l', dest='lang_code',
         type=str, default='en',
@@ -43,6 +72,47 @@ def parse_args():
         '--soft-filter', dest='strong_filter', action='store_false',
         default=True,
         help='Apply a softer filter for wordcloud words')
+    parser.add_argument(
+        '--nlp-batch-size', dest='nlp_batch_size',
+        type=int, default=1000,
+        help='Number of messages per batch when tokenizing')
+    parser.add_argument(
+        '--nlp-processes', dest='nlp_processes',
+        type=int, default=1,
+        help='Number of processes to use when tokenizing (-1 for all cores)')
+    parser.add_argument(
+        '--max-senders', dest='max_senders',
+        type=int, default=5,
+        help='Number of most active senders to generate wordclouds for')
+    parser.add_argument(
+        '--top-messages', dest='top_messages',
+        type=int, default=1000,
+        help='Number of most common messages to list')
+    parser.add_argument(
+        '--render-workers', dest='render_workers',
+        type=int, default=None,
+        help='Number of processes to render wordclouds and figures with (default: number of cores)')
+    parser.add_argument(
+        '--analysis-workers', dest='analysis_workers',
+        type=int, default=None,
+        help='Number of analyses to run concurrently (default: number of cores)')
+    parser.add_argument(
+        '--batch-workers', dest='batch_workers',
+        type=int, default=None,
+        help='Number of chats to analyze concurrently in batch mode (default: number of cores)')
+    parser.add_argument(
+        '--combined', dest='combined', action='store_true',
+        help='In batch mode, also report message counts of all chats combined')
+    parser.add_argument(
+        '--memo-size', dest='memo_size',
+        type=int, default=memo.DEFAULT_MAX_MB,
+        help=f'Megabytes of earlier outputs to keep, outputs of unchanged analyses are reused (default: {memo.DEFAULT_MAX_MB}, 0 to disable)')
+    parser.add_argument(
+        '--profile', dest='profile', action='store_true',
+        help='Record time and memory of each stage to profile.json in the output folder')
+    parser.add_argument(
+        '--trace-memory', dest='trace_memory', action='store_true',
+        help='With --profile, also trace python memory allocations (slower)')
     parser.add_argument(
         '--custom-filter', dest='custom_word_filter',
         type=Path, default=None,
@@ -80,8 +150,20 @@ def resolve_output(output_path, clear=False, force_clear=False, ignore=None):
         output_path.mkdir(parents=True)
     if clear or force_clear:
         print(f'Clearing output folder: {output_path}')
+        if (output_path / memo.MANIFEST_NAME).is_file():
+            # Only the outputs listed in the manifest are deleted
+            confirm = force_clear
+            if not force_clear:
+                confirm_input = input(f'Delete outputs listed in {memo.MANIFEST_NAME}? (y/n) ')
+                confirm = confirm_input.lower() == 'y'
+            if confirm:
+                for name in memo.clear(output_path):
+                    print(f'Deleted {name}')
+            return output_path
         children = sorted(list(output_path.iterdir()), key=lambda x: str(x))
         for child in children:
+            if child.is_dir():
+                continue  # e.g. chat folders in batch mode
             for ignored in ignore:
                 if ignored in str(child):
                     break
@@ -119,20 +201,36 @@ def open_file_explorer(path=None):
         subprocess.Popen(['xdg-open', path])
 
 
-def generate_random_line(word_count=None):
-    word_count = random.randint(1, 12) if word_count is None else word_count
-    words = [random.choice(LOREM_IPSUM_WORDS) for i in range(word_count)]
-    line = ' '.join(words).lower().capitalize()
-    return line
+def file_hash(file, size=None, chunk_size=2**20):
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        while chunk := f.read(chunk_size if size is None else min(chunk_size, size)):
+            h.update(chunk)
+            if size is not None:
+                size -= len(chunk)
+    return h.hexdigest()
+
+
+def add_time_columns(df):
+    # Derive weekday (0 is Monday) and hour from the datetime64 date column with integer arithmetic
+    ns = df['date'].values.astype('datetime64[ns]').view(np.int64)
+    df['weekday'] = ((ns // DAY_NS + 3) % 7).astype(np.int8)  # 1970-01-01 was a Thursday
+    df['hour'] = (ns // HOUR_NS % 24).astype(np.int8)
+    return df
+
+
+def print_memory_usage(df, name='Chat'):
+    usage = df.memory_usage(deep=True, index=False)
+    rows = max(len(df.index), 1)
+    print(f'{name} memory usage: {usage.sum() / 2**20:,.1f} MB ({usage.sum() / rows:,.0f} bytes per row)')
+    for column, size in usage.items():
+        print(f'    {column:<12}{str(df[column].dtype):<18}{size / 2**20:>10,.1f} MB')
 
 
-def generate_random_date(week_range=3, day_range=7, hour_range=24, minute_range=60):
-    t = arrow.now()
-    t = t.shift(weeks=random.randint(-week_range, 0))
-    t = t.shift(days=random.randint(-day_range, 0))
-    t = t.shift(hours=random.randint(-hour_range, 0))
-    t = t.shift(minutes=random.randint(-minute_range, 0))
-    return t
+def keyed_alias(name, key):
+    # The same name always gets the same alias with the same key
+    digest = hmac.new(key.encode(), name.encode(), hashlib.sha256).hexdigest()
+    return f'{CRYPTO_NAMES[int(digest[:8], 16) % len(CRYPTO_NAMES)]} {digest[8:16]}'
 
 
 def h256(input_str):
@@ -0,0 +1,107 @@
+import itertools
+import re
+from datetime import datetime
+
+
+WHATSAPP_DATE_FORMAT = '%m/%d/%y, %H:%M'
+MEDIA_MESSAGE = '<Media omitted>'
+HEADER_RE = re.compile(
+    r'^([0-9]{1,2}/[0-9]{1,2}/[0-9]{2}, [0-9]{2}:[0-9]{2}) - (.*?): (.*)$',
+    re.MULTILINE)
+
+
+class ChatReader:
+    def __init__(self, file, line_limit=None, block_lines=10_000, offset=0):
+        self.file = file
+        self.line_limit = line_limit
+        self.block_lines = block_lines
+        self.offset = offset
+        self.line_count = 0
+        # Byte offset and date of the last message header, for resuming later
+        self.last_offset = offset
+        self.last_date = None
+
+    def lines(self):
+        # Lines as str.split('\n') would produce them, with their byte offsets
+        position = self.offset
+        last = b'\n'
+        with open(self.file, 'rb') as f:
+            f.seek(self.offset)
+            for last in itertools.islice(f, self.line_limit):
+                self.line_count += 1
+                yield position, last.decode('utf-8').removesuffix('\n').removesuffix('\r')
+                position += len(last)
+        if last.endswith(b'\n') and (self.line_limit is None or self.line_count < self.line_limit):
+            self.line_count += 1
+            yield position, ''
+
+    def blocks(self):
+        lines = self.lines()
+        while block := list(itertools.islice(lines, self.block_lines)):
+            offsets, texts = zip(*block)
+            yield offsets, '\n'.join(texts)
+
+    def records(self):
+        # A single regex pass per block finds the header lines, the lines between
+        # two headers are continuations of the previous message. Continuation lines
+        # are folded the same way the line-by-line importer did: anything up to the
+        # first " - " is dropped, and lines preceding the first message are skipped.
+        record = None
+        dates = {}  # Messages often share the same minute, parse each once
+        for offsets, text in self.blocks():
+            pos = 0
+            line_index = line_pos = 0
+            for match in HEADER_RE.finditer(text):
+                date = dates.get(match[1], False)
+                if date is False:
+                    date = dates[match[1]] = _parse_date(match[1])
+                if date is None:
+                    # Invalid date, leave the line to be folded as a continuation
+                    continue
+                _fold_continuation(_continuation(text, pos, match.start()), record)
+                if record is not None:
+                    yield tuple(record)
+                record = [date, match[2], match[3]]
+                pos = match.end()
+                line_index += text.count('\n', line_pos, match.start())
+                line_pos = match.start()
+                self.last_offset = offsets[line_index]
+                self.last_date = date
+            _fold_continuation(_continuation(text, pos, len(text)), record)
+        if record is not None:
+            yield tuple(record)
+
+
+def iter_batches(records, batch_size):
+    records = iter(records)
+    while batch := list(itertools.islice(records, batch_size)):
+        yield batch
+
+
+def _parse_date(date):
+    try:
+        return datetime.strptime(date, WHATSAPP_DATE_FORMAT)
+    except ValueError:
+        return None
+
+
+def _continuation(text, start, end):
+    if start > 0:
+        start += 1  # newline ending the previous header
+    if end < len(text):
+        end -= 1  # newline preceding the next header
+    if start > end:
+        return None
+    return text[start:end]
+
+
+def _fold_continuation(block, record):
+    if block is None:
+        return
+    if ' - ' in block:
+        block = '\n'.join(line.split(' - ', 1)[-1] for line in block.split('\n'))
+    if record is None:
+        for line in block.split('\n'):
+            print(f'Failed to process line: {line}')
+        return
+    record[2] += f'\n{block}'